@@ -1,44 +1,213 @@
-from flask import Flask, render_template, request, redirect, session, flash, jsonify, send_file
-import sqlite3, os, re
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, request, redirect, session, flash, jsonify, send_file, g, has_app_context, has_request_context, url_for, Response, make_response, before_render_template, template_rendered
+import sqlite3, os, re, queue, threading, json, base64, time, zlib, random, smtplib, socket, glob, zipfile, hashlib, tempfile, bisect
+from collections import deque, OrderedDict
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from datetime import datetime, timedelta
 import secrets
-from flask_mail import Mail, Message
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-import csv
+import math
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import TooManyRequests
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
+# ReportLab, Flask-Mail, Pillow, csv and the process pool are imported where
+# they are used; most processes and requests never need them
+
+SECRET_KEY_FILE = os.environ.get("SECRET_KEY_FILE", "secret_key")
+
+def load_secret_key(path=SECRET_KEY_FILE):
+    """The key stored in path, generated on first use.
+
+    Every worker process and restart reads the same key, so sessions stay
+    valid; the first process to start writes it.
+    """
+    if not os.path.exists(path):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            # Fails if another worker linked its key first; theirs is kept
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+    with open(path) as f:
+        return f.read().strip()
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)  # More secure secret key
+# Compiled templates are kept on disk, so a new worker skips parsing them.
+# Must be set before anything touches app.jinja_env
+JINJA_CACHE_FOLDER = "jinja_cache"
+os.makedirs(JINJA_CACHE_FOLDER, exist_ok=True)
+app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache(JINJA_CACHE_FOLDER)}
+# Set SECRET_KEY in production, or share the secret_key file between hosts
+app.secret_key = os.environ.get("SECRET_KEY") or load_secret_key()
 
 # File upload configuration
 UPLOAD_FOLDER = "static/uploads"
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+UPLOAD_GC_GRACE = 3600  # seconds an unreferenced upload is kept, covers requests still in flight
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+
+# Resized copies of product images, longest side in pixels; each is written
+# as JPEG and WebP next to the original in VARIANT_FOLDER
+IMAGE_VARIANTS = {"thumb": 160, "card": 400, "detail": 1000}
+VARIANT_FOLDER = os.path.join(UPLOAD_FOLDER, "variants")
+os.makedirs(VARIANT_FOLDER, exist_ok=True)
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
-# Email configuration (you'll need to add your SMTP details)
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = 'jspmbsiotr23@gmail.com'  # Change this
-app.config['MAIL_PASSWORD'] = 'Agro@510'      # Change this
-app.config['MAIL_DEFAULT_SENDER'] = 'jspmbsiotr23@gmail.com'
+# Rendered invoice PDFs, one file per order version
+INVOICE_CACHE_FOLDER = "invoice_cache"
+INVOICE_WORKERS = os.cpu_count() or 1
+os.makedirs(INVOICE_CACHE_FOLDER, exist_ok=True)
 
-mail = Mail(app)
+# Email configuration (you'll need to add your SMTP details)
+# Any of these can be overridden from the environment, e.g. to point the
+# outbox worker at a local test SMTP server
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '1') == '1'
+app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'jspmbsiotr23@gmail.com')  # Change this
+app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', 'Agro@510')      # Change this
+app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'jspmbsiotr23@gmail.com')
+
+def get_mail():
+    """Flask-Mail, set up on first use; only the outbox worker sends mail"""
+    if "mail" not in app.extensions:
+        from flask_mail import Mail
+        Mail(app)
+    return app.extensions["mail"]
+
+# Serving settings, see wsgi.py. TRUSTED_PROXIES is how many reverse proxies
+# sit in front of the app and set X-Forwarded-For/-Proto/-Host
+app.config['SESSION_COOKIE_SECURE'] = os.environ.get('SESSION_COOKIE_SECURE', '0') == '1'
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
 
 DB = "database.db"
+DB_POOL_SIZE = 8
+
+# Opt-in query debugging: logs statements slower than SLOW_QUERY_MS, statements
+# run QUERY_REPEAT_THRESHOLD or more times in one request (likely N+1 loops)
+# and a per-request summary. Costs a trace callback per statement, keep it off
+# in production.
+app.config['QUERY_DEBUG'] = os.environ.get('QUERY_DEBUG', '0') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['QUERY_REPEAT_THRESHOLD'] = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+if app.config['QUERY_DEBUG']:
+    app.logger.setLevel("INFO")
+
+# Applied once when a connection is opened; pooled connections keep them
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA cache_size=-16000",    # 16MB
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
 
 # ================= HELPER FUNCTIONS =================
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def store_upload(upload):
+    """Stream an upload to disk under its SHA-256, returning (filename, created).
+
+    Identical files share one stored copy; created is False when it was
+    already there. Reference counts live in upload_refs, see gc-uploads.
+    """
+    ext = upload.filename.rsplit('.', 1)[1].lower()
+    digest = hashlib.sha256()
+    
+    fd, tmp = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: upload.stream.read(65536), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        
+        filename = f"{digest.hexdigest()[:32]}.{ext}"
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        if os.path.exists(path):
+            # Fresh mtime keeps gc-uploads away until the new reference is committed
+            os.utime(path)
+            return filename, False
+        os.replace(tmp, path)
+        return filename, True
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def variant_name(filename, variant, ext):
+    return f"{os.path.splitext(filename)[0]}_{variant}.{ext}"
+
+def make_image_variants(filename):
+    """Write every IMAGE_VARIANTS size of an uploaded product image as JPEG and WebP.
+
+    Raises UnidentifiedImageError (an OSError) if the file is not an image.
+    """
+    from PIL import Image, ImageOps
+    
+    with Image.open(os.path.join(UPLOAD_FOLDER, filename)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    
+    # JPEG has no alpha channel, flatten transparent images onto white
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        resized.save(os.path.join(VARIANT_FOLDER, variant_name(filename, variant, "jpg")),
+                     "JPEG", quality=82, optimize=True, progressive=True)
+        resized.save(os.path.join(VARIANT_FOLDER, variant_name(filename, variant, "webp")),
+                     "WEBP", quality=80, method=4)
+
+def save_product_image(upload):
+    """Store an uploaded product image and its variants; returns the filename or None if it is not a usable image"""
+    from PIL import Image
+    
+    filename, created = store_upload(upload)
+    if has_image_variants(filename):
+        return filename
+    try:
+        make_image_variants(filename)
+    except (OSError, Image.DecompressionBombError):
+        if created:
+            os.remove(os.path.join(UPLOAD_FOLDER, filename))
+        return None
+    return filename
+
+def has_image_variants(filename):
+    # The detail WebP is written last
+    return os.path.exists(os.path.join(VARIANT_FOLDER, variant_name(filename, "detail", "webp")))
+
+@app.template_global()
+def image_variants(filename):
+    """src and srcset values for a product image's variants, or None until they exist"""
+    if not has_image_variants(filename):
+        return None
+    
+    urls = {ext: {variant: url_for("static", filename=f"uploads/variants/{variant_name(filename, variant, ext)}")
+                  for variant in IMAGE_VARIANTS}
+            for ext in ("jpg", "webp")}
+    srcset = {ext: ", ".join(f"{urls[ext][variant]} {size}w" for variant, size in IMAGE_VARIANTS.items())
+              for ext in urls}
+    return {"src": urls["jpg"], "jpg": srcset["jpg"], "webp": srcset["webp"]}
+
 def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
@@ -47,16 +216,340 @@ def validate_password(password):
     """Password must be at least 6 characters"""
     return len(password) >= 6
 
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", text))
+
+# bm25 column weights for products_fts(name, description, category)
+SEARCH_RANK = "bm25(products_fts, 10.0, 1.0, 5.0)"
+
+# Catalog sort modes: (sort expression, direction). products.id breaks ties
+CATALOG_SORTS = {
+    "newest": ("products.created_at", "DESC"),
+    "price_low": ("products.price", "ASC"),
+    "price_high": ("products.price", "DESC"),
+    "name": ("products.name", "ASC"),
+    "relevance": (SEARCH_RANK, "ASC"),
+}
+CATALOG_PAGE_SIZE = 24
+CATALOG_MAX_PAGE_SIZE = 96
+
+def encode_cursor(*values):
+    """Pack the keyset position of a page's last row into an opaque token"""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):
+    """Inverse of encode_cursor(); returns None for a missing or malformed token"""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    # Values are bound as SQL parameters and hashed into cache keys
+    if not isinstance(values, list) or not all(isinstance(v, (str, int, float)) for v in values):
+        return None
+    return values
+
+def page_links(endpoint, next_cursor):
+    """First/next page URLs for a keyset-paginated listing, keeping the other query args"""
+    args = {**request.view_args, **request.args.to_dict()}
+    had_cursor = args.pop("cursor", None) is not None
+    first_url = url_for(endpoint, **args) if had_cursor else None
+    next_url = url_for(endpoint, cursor=next_cursor, **args) if next_cursor else None
+    return first_url, next_url
+
+REVIEWS_PAGE_SIZE = 20
+
+def page_etag(*parts):
+    """Strong ETag for a page built from everything its HTML depends on.
+
+    The CSRF token and navbar badges that base.html renders are included.
+    """
+    parts += (csrf_token(), session.get("badges"))
+    return hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()
+
+def client_has(etag):
+    """True when the client's cached copy is current and no flash message is waiting to be shown"""
+    return request.if_none_match.contains(etag) and not session.get("_flashes")
+
+def revalidate(response, etag, last_modified=None):
+    """Mark a per-user page as cacheable only after an ETag check"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# Content hash per static file, keyed on (mtime, size) so edits are picked up
+_static_hashes = {}
+
+# Uploads stored since content addressing are named by their SHA-256 (and
+# their variants after that name), so the name already versions them
+CONTENT_ADDRESSED = re.compile(r"uploads/(variants/)?[0-9a-f]{32}(_\w+)?\.\w+")
+
+def static_hash(filename):
+    path = os.path.join(app.static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    cached = _static_hashes.get(filename)
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    version = digest.hexdigest()[:12]
+    _static_hashes[filename] = ((stat.st_mtime_ns, stat.st_size), version)
+    return version
+
+@app.url_defaults
+def static_version(endpoint, values):
+    """url_for('static', ...) gets ?v=<content hash>, so a changed file gets a new URL.
+
+    Uploads are left alone: hashing every product image once per process
+    would only repeat what content addressing did, and keep a dictionary
+    entry per image for good.
+    """
+    if (endpoint == "static" and "filename" in values and "v" not in values
+            and not values["filename"].startswith("uploads/")):
+        version = static_hash(values["filename"])
+        if version:
+            values["v"] = version
+
+@app.after_request
+def static_cache_headers(response):
+    # A URL carrying the file's current hash can never change, let browsers keep it
+    if request.endpoint == "static" and response.status_code == 200:
+        filename = request.view_args["filename"]
+        version = request.args.get("v")
+        if CONTENT_ADDRESSED.fullmatch(filename) or (version and version == static_hash(filename)):
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+    return response
+
+ORDER_STATUSES = ["pending", "confirmed", "shipped", "delivered", "cancelled"]
+ADMIN_ORDERS_PAGE_SIZE = 50
+EXPORT_BATCH_SIZE = 2000
+ORDER_COUNT_TTL = 60  # seconds
+_order_counts = {}
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+def order_filters(args):
+    """WHERE clause and params for the admin order filters (status, dates, email, product)"""
+    clauses = ["1=1"]
+    params = []
+    
+    status = args.get("status", "")
+    if status in ORDER_STATUSES:
+        clauses.append("orders.status=?")
+        params.append(status)
+    
+    date_from = parse_date(args.get("date_from", ""))
+    if date_from:
+        clauses.append("orders.order_date >= ?")
+        params.append(date_from.isoformat())
+    
+    date_to = parse_date(args.get("date_to", ""))
+    if date_to:
+        clauses.append("orders.order_date < ?")
+        params.append((date_to + timedelta(days=1)).isoformat())
+    
+    email = args.get("email", "").strip()
+    if email:
+        clauses.append("orders.user_id = (SELECT id FROM users WHERE email=?)")
+        params.append(email)
+    
+    product = fts_query(args.get("product", ""))
+    if product:
+        clauses.append("""orders.id IN (
+            SELECT order_items.order_id FROM order_items
+            WHERE order_items.product_id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)
+            UNION ALL
+            SELECT legacy.id FROM orders AS legacy
+            WHERE legacy.product_id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?))""")
+        params.extend([f"name : ({product})"] * 2)
+    
+    return " AND ".join(clauses), params
+
+def order_count(conn, where, params):
+    """COUNT(*) for an order filter, cached per filter for ORDER_COUNT_TTL seconds"""
+    key = (where, tuple(params))
+    now = time.monotonic()
+    cached = _order_counts.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    count = conn.execute(f"SELECT COUNT(*) FROM orders WHERE {where}", params).fetchone()[0]
+    if len(_order_counts) >= 256:
+        _order_counts.clear()
+    _order_counts[key] = (now + ORDER_COUNT_TTL, count)
+    return count
+
 # ================= DATABASE =================
-def db():
-    conn = sqlite3.connect(DB)
+class PooledConnection(sqlite3.Connection):
+    """Connection handed out by db().
+
+    close() only discards uncommitted work so routes can keep calling it;
+    the connection goes back to the pool when the app context tears down.
+    """
+
+    # Statements run and seconds spent in them, reset by db() for each request
+    queries = 0
+    query_time = 0.0
+    # QueryLog for this request when QUERY_DEBUG is on
+    query_log = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.query_time += elapsed
+            if self.query_log is not None:
+                self.query_log.finished(sql, elapsed)
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.query_time += elapsed
+            if self.query_log is not None:
+                self.query_log.finished(sql, elapsed)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def dispose(self):
+        sqlite3.Connection.close(self)
+
+class QueryLog:
+    """Every statement one request ran, with bound values and timings.
+
+    Fed by a trace callback, which sees the statement with its parameters
+    filled in, and by PooledConnection.execute(), which times it.
+    """
+    def __init__(self, slow_ms, repeat_threshold):
+        self.slow = slow_ms / 1000
+        self.repeat_threshold = repeat_threshold
+        self.statements = []
+        self._expanded = None
+    
+    def trace(self, statement):
+        # Statements run by triggers and FTS5 internals come prefixed with "-- "
+        if not statement.startswith("--"):
+            self._expanded = " ".join(statement.split())
+    
+    def finished(self, sql, elapsed):
+        expanded, self._expanded = self._expanded or " ".join(sql.split()), None
+        self.statements.append((sql, expanded, elapsed))
+        if elapsed >= self.slow:
+            app.logger.warning("Slow query (%.1fms) in %s: %s", elapsed * 1000, request_label(), expanded)
+    
+    def repeated(self):
+        """[(count, sql, first expanded statement)] for statements run at least repeat_threshold times"""
+        counts = {}
+        for sql, expanded, _ in self.statements:
+            count, first = counts.get(sql, (0, expanded))
+            counts[sql] = (count + 1, first)
+        return sorted(((count, sql, first) for sql, (count, first) in counts.items()
+                       if count >= self.repeat_threshold), reverse=True)
+    
+    def report(self):
+        label = request_label()
+        for count, sql, first in self.repeated():
+            app.logger.warning("Possible N+1 in %s: ran %s times: %s (first: %s)",
+                               label, count, " ".join(sql.split()), first)
+        app.logger.info("%s: %s queries in %.1fms, slowest %.1fms", label, len(self.statements),
+                        sum(s[2] for s in self.statements) * 1000,
+                        max((s[2] for s in self.statements), default=0) * 1000)
+
+def request_label():
+    if has_request_context():
+        return f"{request.method} {request.path} ({request.endpoint})"
+    return "no request"
+
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_pool_pid = os.getpid()
+_local = threading.local()
+
+def _connect():
+    conn = sqlite3.connect(DB, factory=PooledConnection, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db():
-    conn = db()
-    cur = conn.cursor()
-    cur.executescript("""
+def _checkout():
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        # Connections must not cross a fork, start a fresh pool in the child
+        _pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        _pool_pid = os.getpid()
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+def _release(conn):
+    conn.close()
+    if conn.query_log is not None:
+        conn.set_trace_callback(None)
+        conn.query_log = None
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.dispose()
+
+def db():
+    """Return the connection for the current request (or thread outside one)."""
+    if has_app_context():
+        if "db" not in g:
+            g.db = _checkout()
+            g.db.queries = 0
+            g.db.query_time = 0.0
+            if app.config["QUERY_DEBUG"]:
+                g.db.query_log = QueryLog(app.config["SLOW_QUERY_MS"], app.config["QUERY_REPEAT_THRESHOLD"])
+                g.db.set_trace_callback(g.db.query_log.trace)
+        return g.db
+
+    # CLI commands and scripts reuse one connection per thread
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.conn = _connect()
+        _local.pid = os.getpid()
+    return _local.conn
+
+@app.teardown_request
+def report_queries(exc):
+    conn = g.get("db")
+    if conn is not None and conn.query_log is not None:
+        conn.query_log.report()
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        _release(conn)
+
+SCHEMA = """
     CREATE TABLE IF NOT EXISTS users(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL, 
@@ -139,17 +632,1116 @@ def init_db():
         token TEXT NOT NULL,
         expires_at TIMESTAMP NOT NULL,
         used INTEGER DEFAULT 0);
+"""
+
+def _split_orders(conn):
+    """Migration 8: orders becomes a header, its lines move to order_items.
+
+    Existing rows keep product_id/quantity until backfill-order-items moves
+    them in batches, so the columns lose NOT NULL. SQLite cannot ALTER a
+    constraint; this is its documented in-place edit for dropping NOT NULL,
+    which leaves the stored rows untouched.
+    """
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='orders'").fetchone()[0]
+    relaxed = re.sub(r"\b(product_id|quantity) INTEGER NOT NULL", r"\1 INTEGER", sql)
+    if relaxed.count("NOT NULL") != sql.count("NOT NULL") - 2:
+        raise RuntimeError("Unexpected orders schema, cannot relax product_id/quantity")
+    
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    conn.execute("PRAGMA writable_schema=ON")
+    conn.execute("UPDATE sqlite_master SET sql=? WHERE type='table' AND name='orders'", (relaxed,))
+    conn.execute(f"PRAGMA schema_version={schema_version + 1}")
+    conn.execute("PRAGMA writable_schema=OFF")
+    
+    conn.execute("ALTER TABLE orders ADD COLUMN payment_method TEXT")
+    conn.execute("""
+        CREATE TABLE order_items(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_price REAL NOT NULL,
+            total_price REAL NOT NULL,
+            FOREIGN KEY(order_id) REFERENCES orders(id),
+            FOREIGN KEY(product_id) REFERENCES products(id))
+    """)
+    conn.execute("CREATE INDEX idx_order_items_order ON order_items(order_id)")
+    conn.execute("CREATE INDEX idx_order_items_product ON order_items(product_id)")
+
+# Lines of one order, from order_items or the pre-order_items orders row, with
+# the category each was sold under; lines from before categories were stored
+# whose product is gone have none and stay out of the category rollup
+SALES_LINES = """
+    SELECT category, quantity, total_price FROM order_items WHERE order_id = :order_id
+    UNION ALL
+    SELECT category, quantity, total_price FROM orders WHERE id = :order_id AND product_id IS NOT NULL
+"""
+
+def record_sales(conn, order_id, sign=1):
+    """Add (sign=1) or remove (sign=-1) an order from the sales rollups.
+
+    Called inside the transaction that places or cancels the order, so the
+    dashboard totals always match the orders table.
+    """
+    conn.execute("""
+        INSERT INTO sales_daily(day, orders, revenue)
+        SELECT DATE(order_date), :sign, :sign * total_price FROM orders WHERE id = :order_id
+        ON CONFLICT(day) DO UPDATE SET orders = orders + excluded.orders, revenue = revenue + excluded.revenue
+    """, {"order_id": order_id, "sign": sign})
+    conn.execute(f"""
+        INSERT INTO sales_daily_category(day, category, units, revenue)
+        SELECT (SELECT DATE(order_date) FROM orders WHERE id = :order_id), lines.category,
+               :sign * SUM(lines.quantity), :sign * SUM(lines.total_price)
+        FROM ({SALES_LINES}) AS lines
+        WHERE lines.category IS NOT NULL
+        GROUP BY lines.category
+        ON CONFLICT(day, category) DO UPDATE SET
+            units = units + excluded.units, revenue = revenue + excluded.revenue
+    """, {"order_id": order_id, "sign": sign})
+
+def rebuild_sales_rollups(conn):
+    """Recompute both rollup tables from every order that is not cancelled"""
+    conn.execute("DELETE FROM sales_daily")
+    conn.execute("DELETE FROM sales_daily_category")
+    conn.execute("""
+        INSERT INTO sales_daily(day, orders, revenue)
+        SELECT DATE(order_date), COUNT(*), SUM(total_price)
+        FROM orders WHERE status != 'cancelled'
+        GROUP BY DATE(order_date)
+    """)
+    conn.execute("""
+        INSERT INTO sales_daily_category(day, category, units, revenue)
+        SELECT day, category, SUM(quantity), SUM(total_price) FROM (
+            SELECT DATE(orders.order_date) as day, order_items.category,
+                   order_items.quantity, order_items.total_price
+            FROM orders
+            JOIN order_items ON order_items.order_id = orders.id
+            WHERE orders.status != 'cancelled'
+            UNION ALL
+            SELECT DATE(orders.order_date), orders.category, orders.quantity, orders.total_price
+            FROM orders
+            WHERE orders.status != 'cancelled' AND orders.product_id IS NOT NULL)
+        WHERE category IS NOT NULL
+        GROUP BY day, category
     """)
 
-    # Create default admin with hashed password
-    if not cur.execute("SELECT * FROM admin").fetchone():
-        hashed = generate_password_hash("admin123")
-        cur.execute("INSERT INTO admin VALUES(NULL,'admin',?)", (hashed,))
+def _create_sales_rollups(conn):
+    """Migration 10: per-day sales rollups read by the admin dashboard.
 
+    They are filled by migration 15 once every line carries its category.
+    """
+    conn.execute("""
+        CREATE TABLE sales_daily(
+            day TEXT PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE sales_daily_category(
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY(day, category)) WITHOUT ROWID
+    """)
+
+def _store_line_categories(conn):
+    """Migration 15: the category each order line was sold under.
+
+    Cancelling an order then takes its sales back out of the category they
+    went into, even if the product has moved since. orders.category belongs
+    to the single line of orders from before order_items, like
+    orders.product_id. The rollups are rebuilt from the stored categories.
+    """
+    conn.execute("ALTER TABLE order_items ADD COLUMN category TEXT")
+    conn.execute("""
+        UPDATE order_items SET category = (SELECT category FROM products WHERE products.id = order_items.product_id)
+    """)
+    conn.execute("ALTER TABLE orders ADD COLUMN category TEXT")
+    conn.execute("""
+        UPDATE orders SET category = (SELECT category FROM products WHERE products.id = orders.product_id)
+        WHERE product_id IS NOT NULL
+    """)
+    rebuild_sales_rollups(conn)
+
+# Tables whose image column names a file in UPLOAD_FOLDER
+UPLOAD_TABLES = ("products", "user_profile", "admin_profile")
+
+def _upload_refs_sql():
+    """Migration 13: upload_refs counts the rows naming each upload, kept by triggers"""
+    images = " UNION ALL ".join(f"SELECT image FROM {table}" for table in UPLOAD_TABLES)
+    script = f"""
+    CREATE TABLE IF NOT EXISTS upload_refs(
+        filename TEXT PRIMARY KEY,
+        refs INTEGER NOT NULL) WITHOUT ROWID;
+    INSERT INTO upload_refs(filename, refs)
+    SELECT image, COUNT(*) FROM ({images}) WHERE image IS NOT NULL AND image != '' GROUP BY image;
+    """
+    for table in UPLOAD_TABLES:
+        script += f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_upload_ref_insert AFTER INSERT ON {table}
+    WHEN new.image IS NOT NULL BEGIN
+        INSERT INTO upload_refs(filename, refs) VALUES (new.image, 1)
+        ON CONFLICT(filename) DO UPDATE SET refs = refs + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS {table}_upload_ref_delete AFTER DELETE ON {table}
+    WHEN old.image IS NOT NULL BEGIN
+        UPDATE upload_refs SET refs = refs - 1 WHERE filename = old.image;
+    END;
+    CREATE TRIGGER IF NOT EXISTS {table}_upload_ref_update AFTER UPDATE OF image ON {table}
+    WHEN new.image IS NOT old.image BEGIN
+        UPDATE upload_refs SET refs = refs - 1 WHERE filename = old.image;
+        INSERT INTO upload_refs(filename, refs) SELECT new.image, 1 WHERE new.image IS NOT NULL
+        ON CONFLICT(filename) DO UPDATE SET refs = refs + 1;
+    END;
+    """
+    return script
+
+# Each entry upgrades the schema by one version and PRAGMA user_version
+# records the last one applied. Entries are SQL scripts or callables taking
+# the connection. Append new migrations; never edit one that has shipped.
+MIGRATIONS = [
+    # 1: base tables
+    SCHEMA,
+
+    # 2: secondary indexes for the hot queries, unique cart/wishlist pairs
+    """
+    UPDATE cart SET quantity = (
+        SELECT SUM(c2.quantity) FROM cart c2
+        WHERE c2.user_id = cart.user_id AND c2.product_id = cart.product_id)
+    WHERE id IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id HAVING COUNT(*) > 1);
+    DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id);
+    DELETE FROM wishlist WHERE id NOT IN (SELECT MIN(id) FROM wishlist GROUP BY user_id, product_id);
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_user_product ON cart(user_id, product_id);
+    CREATE INDEX IF NOT EXISTS idx_cart_product ON cart(product_id);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_wishlist_user_product ON wishlist(user_id, product_id);
+    CREATE INDEX IF NOT EXISTS idx_wishlist_product ON wishlist(product_id);
+    CREATE INDEX IF NOT EXISTS idx_orders_user_date ON orders(user_id, order_date);
+    CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(order_date);
+    CREATE INDEX IF NOT EXISTS idx_orders_status_date ON orders(status, order_date);
+    CREATE INDEX IF NOT EXISTS idx_orders_product ON orders(product_id);
+    CREATE INDEX IF NOT EXISTS idx_reviews_product_created ON reviews(product_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_password_reset_token ON password_reset(token);
+    CREATE INDEX IF NOT EXISTS idx_products_category_price ON products(category, price);
+    CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock);
+    """,
+
+    # 3: full-text product search, kept in sync with products by triggers
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, category,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+    INSERT INTO products_fts(products_fts) VALUES('rebuild');
+
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_fts_update
+    AFTER UPDATE OF name, description, category ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO products_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END;
+    """,
+    # 4: one index per catalog sort order so keyset pages are range seeks
+    """
+    CREATE INDEX IF NOT EXISTS idx_products_created ON products(created_at);
+    CREATE INDEX IF NOT EXISTS idx_products_price ON products(price);
+    CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);
+    CREATE INDEX IF NOT EXISTS idx_products_category_created ON products(category, created_at);
+    CREATE INDEX IF NOT EXISTS idx_products_category_name ON products(category, name);
+    """,
+
+    # 5: admin order filter by product, still newest first
+    """
+    DROP INDEX IF EXISTS idx_orders_product;
+    CREATE INDEX IF NOT EXISTS idx_orders_product_date ON orders(product_id, order_date);
+    """,
+    # 6: transactional email outbox, drained by the outbox-worker command
+    """
+    CREATE TABLE IF NOT EXISTS email_outbox(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipient TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT,
+        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(next_attempt_at) WHERE sent_at IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_email_outbox_sent ON email_outbox(sent_at) WHERE sent_at IS NOT NULL;
+    """,
+    # 7: order row version, bumped on every status change; keys the invoice cache
+    """
+    ALTER TABLE orders ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
+    """,
+    # 8: order header + order_items lines
+    _split_orders,
+    # 9: rating aggregates on products, kept in sync with reviews by triggers
+    """
+    ALTER TABLE products ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE products ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE products ADD COLUMN rating_1 INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE products ADD COLUMN rating_2 INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE products ADD COLUMN rating_3 INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE products ADD COLUMN rating_4 INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE products ADD COLUMN rating_5 INTEGER NOT NULL DEFAULT 0;
+    UPDATE products SET (rating_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5) = (
+        SELECT COUNT(*), COALESCE(SUM(rating), 0), COALESCE(SUM(rating=1), 0), COALESCE(SUM(rating=2), 0),
+               COALESCE(SUM(rating=3), 0), COALESCE(SUM(rating=4), 0), COALESCE(SUM(rating=5), 0)
+        FROM reviews WHERE reviews.product_id = products.id);
+
+    CREATE TRIGGER IF NOT EXISTS reviews_rating_insert AFTER INSERT ON reviews BEGIN
+        UPDATE products SET rating_count = rating_count + 1, rating_sum = rating_sum + new.rating,
+            rating_1 = rating_1 + (new.rating=1), rating_2 = rating_2 + (new.rating=2),
+            rating_3 = rating_3 + (new.rating=3), rating_4 = rating_4 + (new.rating=4),
+            rating_5 = rating_5 + (new.rating=5)
+        WHERE id = new.product_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS reviews_rating_delete AFTER DELETE ON reviews BEGIN
+        UPDATE products SET rating_count = rating_count - 1, rating_sum = rating_sum - old.rating,
+            rating_1 = rating_1 - (old.rating=1), rating_2 = rating_2 - (old.rating=2),
+            rating_3 = rating_3 - (old.rating=3), rating_4 = rating_4 - (old.rating=4),
+            rating_5 = rating_5 - (old.rating=5)
+        WHERE id = old.product_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS reviews_rating_update
+    AFTER UPDATE OF rating, product_id ON reviews BEGIN
+        UPDATE products SET rating_count = rating_count - 1, rating_sum = rating_sum - old.rating,
+            rating_1 = rating_1 - (old.rating=1), rating_2 = rating_2 - (old.rating=2),
+            rating_3 = rating_3 - (old.rating=3), rating_4 = rating_4 - (old.rating=4),
+            rating_5 = rating_5 - (old.rating=5)
+        WHERE id = old.product_id;
+        UPDATE products SET rating_count = rating_count + 1, rating_sum = rating_sum + new.rating,
+            rating_1 = rating_1 + (new.rating=1), rating_2 = rating_2 + (new.rating=2),
+            rating_3 = rating_3 + (new.rating=3), rating_4 = rating_4 + (new.rating=4),
+            rating_5 = rating_5 + (new.rating=5)
+        WHERE id = new.product_id;
+    END;
+    """,
+    # 10: daily sales rollups for the dashboard
+    _create_sales_rollups,
+    # 11: catalog version, bumped by any product change; invalidates CatalogCache in every process
+    """
+    CREATE TABLE IF NOT EXISTS catalog_version(
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL);
+    INSERT OR IGNORE INTO catalog_version(id, version) VALUES(1, 1);
+
+    CREATE TRIGGER IF NOT EXISTS catalog_version_insert AFTER INSERT ON products BEGIN
+        UPDATE catalog_version SET version = version + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS catalog_version_update AFTER UPDATE ON products BEGIN
+        UPDATE catalog_version SET version = version + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS catalog_version_delete AFTER DELETE ON products BEGIN
+        UPDATE catalog_version SET version = version + 1;
+    END;
+    """,
+    # 12: products.updated_at (millisecond precision) for product page ETags and Last-Modified
+    """
+    ALTER TABLE products ADD COLUMN updated_at TIMESTAMP;
+    UPDATE products SET updated_at = strftime('%Y-%m-%d %H:%M:%f', COALESCE(created_at, 'now'));
+
+    CREATE TRIGGER IF NOT EXISTS products_touch_insert AFTER INSERT ON products
+    WHEN new.updated_at IS NULL BEGIN
+        UPDATE products SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = new.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS products_touch_update AFTER UPDATE ON products
+    WHEN new.updated_at IS old.updated_at BEGIN
+        UPDATE products SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = new.id;
+    END;
+    """,
+    # 13: reference counts for content-addressed uploads
+    _upload_refs_sql(),
+    # 14: bump the catalog version only for changes the cached listings show.
+    # Sales and reviews update stock and ratings on every request, and the
+    # updated_at touch is a second UPDATE, so bumping on all of them emptied
+    # every cache twice per sale. Stock counts only when it crosses the out of
+    # stock or low stock (< 10) line; rating averages may lag by the cache TTL.
+    """
+    DROP TRIGGER IF EXISTS catalog_version_update;
+    CREATE TRIGGER catalog_version_update
+    AFTER UPDATE OF name, category, price, image, description, created_at, stock ON products
+    WHEN new.name IS NOT old.name OR new.category IS NOT old.category OR new.price IS NOT old.price
+        OR new.image IS NOT old.image OR new.description IS NOT old.description
+        OR new.created_at IS NOT old.created_at
+        OR (new.stock > 0) IS NOT (old.stock > 0) OR (new.stock < 10) IS NOT (old.stock < 10)
+    BEGIN
+        UPDATE catalog_version SET version = version + 1;
+    END;
+    """,
+    # 15: category stored on each order line, for the sales rollups
+    _store_line_categories,
+    # 16: emails the worker gave up on (8 attempts) are marked failed, leave
+    # the due index and are purged like sent ones
+    """
+    ALTER TABLE email_outbox ADD COLUMN failed_at TIMESTAMP;
+    UPDATE email_outbox SET failed_at = CURRENT_TIMESTAMP WHERE sent_at IS NULL AND attempts >= 8;
+    DROP INDEX IF EXISTS idx_email_outbox_due;
+    CREATE INDEX idx_email_outbox_due ON email_outbox(next_attempt_at)
+        WHERE sent_at IS NULL AND failed_at IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_email_outbox_failed ON email_outbox(failed_at) WHERE failed_at IS NOT NULL;
+    """,
+]
+
+def migrate(conn):
+    """Apply pending MIGRATIONS, each in its own transaction. Returns the schema version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            if callable(migration):
+                conn.execute("BEGIN")
+                migration(conn)
+            else:
+                conn.executescript("BEGIN;" + migration)
+            conn.execute(f"PRAGMA user_version={target}")
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        version = target
+    return version
+
+def init_db():
+    """Apply pending migrations and create the default admin, see `flask init-db`"""
+    # A connection of its own, closed again, so that nothing is left open
+    # when a preloading server (gunicorn preload_app) forks its workers
+    conn = _connect()
+    try:
+        migrate(conn)
+        cur = conn.cursor()
+
+        # Create default admin with hashed password
+        if not cur.execute("SELECT * FROM admin").fetchone():
+            hashed = generate_password_hash("admin123", PASSWORD_HASH_METHOD)
+            cur.execute("INSERT INTO admin VALUES(NULL,'admin',?)", (hashed,))
+
+        conn.commit()
+    finally:
+        conn.dispose()
+
+def check_schema():
+    """Refuse to serve a database that init-db has not brought up to date; one PRAGMA read"""
+    conn = _connect()
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.dispose()
+    if version != len(MIGRATIONS):
+        raise RuntimeError(f"{DB} is at schema version {version}, this code expects {len(MIGRATIONS)}; "
+                           "run `flask --app app init-db`")
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Create or migrate the schema and add the default admin if there is none."""
+    init_db()
+    click.echo(f"Schema at version {len(MIGRATIONS)}")
+
+# ================= ORDER ITEMS =================
+ORDER_BACKFILL_BATCH = 1000
+
+def order_lines(conn, order_ids):
+    """Line items for the given orders, as {order_id: [rows]}.
+
+    Orders from before order_items existed still carry their one product on
+    the orders row until backfill-order-items moves it, so both are read.
+    """
+    lines = {order_id: [] for order_id in order_ids}
+    ids = list(lines)
+    
+    # Chunked to stay well below SQLite's bound parameter limit
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        marks = ",".join("?" * len(chunk))
+        rows = conn.execute(f"""
+            SELECT order_items.order_id, order_items.product_id, products.name, products.image,
+                   order_items.quantity, order_items.unit_price, order_items.total_price
+            FROM order_items
+            JOIN products ON order_items.product_id = products.id
+            WHERE order_items.order_id IN ({marks})
+            UNION ALL
+            SELECT orders.id, orders.product_id, products.name, products.image,
+                   orders.quantity, orders.total_price / orders.quantity, orders.total_price
+            FROM orders
+            JOIN products ON orders.product_id = products.id
+            WHERE orders.id IN ({marks}) AND orders.product_id IS NOT NULL
+        """, chunk + chunk).fetchall()
+        for row in rows:
+            lines[row["order_id"]].append(row)
+    return lines
+
+def with_lines(conn, rows):
+    """Order rows as plain dicts with their line items under "items" """
+    lines = order_lines(conn, [row["id"] for row in rows])
+    return [dict(row, items=[dict(line) for line in lines[row["id"]]]) for row in rows]
+
+def backfill_order_items(conn, after_id=0, batch_size=ORDER_BACKFILL_BATCH):
+    """Move one batch of pre-order_items orders into order_items.
+
+    Returns (last order id looked at, ids of orders left in place), or
+    (None, []) once nothing is left. Orders whose product was deleted
+    before deletes were restricted would break the foreign key, so they
+    stay on the orders row.
+    """
+    rows = conn.execute("""
+        SELECT orders.id, products.id IS NOT NULL AS has_product FROM orders
+        LEFT JOIN products ON orders.product_id = products.id
+        WHERE orders.id > ? AND orders.product_id IS NOT NULL ORDER BY orders.id LIMIT ?
+    """, (after_id, batch_size)).fetchall()
+    if not rows:
+        return None, []
+    
+    ids = [row["id"] for row in rows if row["has_product"]]
+    skipped = [row["id"] for row in rows if not row["has_product"]]
+    if ids:
+        marks = ",".join("?" * len(ids))
+        conn.execute(f"""
+            INSERT INTO order_items(order_id, product_id, quantity, unit_price, total_price, category)
+            SELECT id, product_id, quantity,
+                   CASE WHEN quantity > 0 THEN total_price / quantity ELSE total_price END, total_price, category
+            FROM orders WHERE id IN ({marks})
+        """, ids)
+        conn.execute(f"UPDATE orders SET product_id=NULL, quantity=NULL, category=NULL WHERE id IN ({marks})", ids)
+        conn.commit()
+    return rows[-1]["id"], skipped
+
+@app.cli.command("backfill-order-items")
+@click.option("--batch-size", default=ORDER_BACKFILL_BATCH, help="Orders moved per transaction.")
+@click.option("--pause", default=0.05, help="Seconds between batches so requests can write.")
+def backfill_order_items_command(batch_size, pause):
+    """Move orders placed before order_items existed into order_items."""
+    conn = db()
+    last_id = 0
+    batches = 0
+    skipped = []
+    
+    while True:
+        last_id, missing = backfill_order_items(conn, last_id, batch_size)
+        if last_id is None:
+            break
+        skipped.extend(missing)
+        batches += 1
+        time.sleep(pause)
+    
+    click.echo(f"Backfill complete after {batches} batch(es)")
+    if skipped:
+        click.echo(f"Left {len(skipped)} order(s) whose product no longer exists on the orders row: "
+                   + ", ".join(map(str, skipped)))
+
+@app.cli.command("rebuild-sales-rollups")
+def rebuild_sales_rollups_command():
+    """Recompute the dashboard sales rollups from the orders table.
+
+    Sales are filed under a product's category at the time of sale; a
+    rebuild refiles all history under the current categories.
+    """
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    rebuild_sales_rollups(conn)
     conn.commit()
-    conn.close()
+    click.echo("Sales rollups rebuilt")
+
+# ================= CATALOG CACHE =================
+CATALOG_CACHE_SIZE = 512
+CATALOG_CACHE_TTL = 300  # seconds
+CARD_CACHE_SIZE = 2048
+
+class CatalogCache:
+    """Bounded LRU of catalog reads, each tagged with the catalog version it was read at.
 
-init_db()
+    An entry is served only while its version is current and it is younger
+    than the TTL. Concurrent misses on one key wait for the first caller's
+    query instead of running their own.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key, version, load):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] == version and entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                
+                loading = self._loading.get((key, version))
+                if loading is None:
+                    loading = self._loading[(key, version)] = threading.Event()
+                    self.misses += 1
+                    break
+                self.coalesced += 1
+            
+            # Another thread is running this query; use its result once stored
+            loading.wait()
+        
+        try:
+            value = load()
+            with self._lock:
+                self._entries[key] = (version, time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[(key, version)]
+            loading.set()
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                    "size": len(self._entries), "maxsize": self.maxsize}
+
+catalog_cache = CatalogCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+def catalog_version(conn):
+    """Current catalog version, read once per request"""
+    if has_app_context() and "catalog_version" in g:
+        return g.catalog_version
+    version = conn.execute("SELECT version FROM catalog_version WHERE id=1").fetchone()[0]
+    if has_app_context():
+        g.catalog_version = version
+    return version
+
+def cached_catalog(conn, key, load):
+    """load() through the catalog cache, valid until the catalog next changes"""
+    return catalog_cache.get(key, catalog_version(conn), load)
+
+# Rendered product cards, valid until the product's updated_at moves. Edits,
+# stock changes and reviews all touch it, though a listing row cached before a
+# change that left the catalog version alone carries the old value until the
+# TTL. The TTL also picks up image variants built later by
+# `flask build-image-variants` in another process.
+card_cache = CatalogCache(CARD_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+@app.template_global()
+def product_card(product):
+    """Markup of a catalog card's shared part (everything but the wishlist button)"""
+    # Rendered straight from the environment: render_template would fire the
+    # render signals again and reset the request's render timer mid-page
+    return card_cache.get(product["id"], product["updated_at"], lambda: Markup(
+        app.jinja_env.get_template("_product_card.html").render(product=product)))
+
+# ================= METRICS =================
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Where worker processes leave their counters for each other, and how often
+METRICS_FOLDER = os.environ.get("METRICS_FOLDER", "metrics")
+METRICS_FLUSH_INTERVAL = 5  # seconds
+ENDPOINT_COUNTERS = ("seconds", "queries", "query_time", "render_time", "bytes")
+CACHE_COUNTERS = ("hits", "misses", "coalesced")
+
+def process_start(pid):
+    """When a process started, in clock ticks since boot, or None without /proc (macOS, Windows)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # starttime is field 22; the command name (field 2) may itself contain spaces
+    return stat.rsplit(")", 1)[1].split()[19]
+
+def process_key(pid):
+    """<pid>-<start time> of a process. PIDs are reused, across container restarts
+    in particular, but not by two processes started at the same tick."""
+    start = process_start(pid)
+    return f"{pid}-{start}" if start else str(pid)
+
+def process_alive(key):
+    """Whether the process a process_key() was taken from is still running"""
+    pid, _, start = key.partition("-")
+    pid = int(pid)
+    if pid != os.getpid():
+        if os.name == "nt":
+            # Only one process serves there, and signal 0 would be CTRL_C_EVENT
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+    # Same PID: the same process only if it started at the same time
+    current = process_start(pid)
+    return not start or current is None or current == start
+
+class RequestMetrics:
+    """Per-endpoint request counters and latency histograms, summed over worker processes.
+
+    All workers sit behind one port, so a scrape lands on any of them. A
+    thread in each process writes its counters to <folder>/<pid>-<start>.json
+    every interval seconds while they change, and exposition() sums every
+    process's file. The files of processes that exited, including those of
+    a previous run whose PIDs were reused, are folded into the collecting
+    process's own counters, so totals do not go backwards when gunicorn
+    recycles a worker or the app restarts.
+    Query time is time spent in execute(), rows fetched afterwards are not
+    included. Streamed responses count as 0 bytes.
+    """
+    def __init__(self, buckets, folder, interval):
+        self.buckets = buckets
+        self.folder = folder
+        self.interval = interval
+        self._endpoints = {}
+        self._inherited = {"endpoints": {}, "caches": {}}
+        self._dirty = False
+        self._writer_pid = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+    
+    def record(self, endpoint, method, status, seconds, queries, query_time, render_time, size):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    "requests": {}, "buckets": [0] * (len(self.buckets) + 1), "seconds": 0.0,
+                    "queries": 0, "query_time": 0.0, "render_time": 0.0, "bytes": 0}
+            key = (method, status)
+            stats["requests"][key] = stats["requests"].get(key, 0) + 1
+            stats["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+            stats["seconds"] += seconds
+            stats["queries"] += queries
+            stats["query_time"] += query_time
+            stats["render_time"] += render_time
+            stats["bytes"] += size
+            self._dirty = True
+            # Threads do not survive fork, so every worker starts its own
+            if self._writer_pid != os.getpid():
+                self._writer_pid = os.getpid()
+                threading.Thread(target=self._write_periodically, name="metrics-writer", daemon=True).start()
+    
+    @staticmethod
+    def _add(total, report):
+        """Add the counters of one report into total; both in the metrics file layout"""
+        for endpoint, stats in report["endpoints"].items():
+            into = total["endpoints"].setdefault(endpoint, {
+                "requests": {}, "buckets": [0] * len(stats["buckets"]), **dict.fromkeys(ENDPOINT_COUNTERS, 0)})
+            for key, count in stats["requests"].items():
+                into["requests"][key] = into["requests"].get(key, 0) + count
+            into["buckets"] = [a + b for a, b in zip(into["buckets"], stats["buckets"])]
+            for key in ENDPOINT_COUNTERS:
+                into[key] += stats[key]
+        for name, stats in report["caches"].items():
+            into = total["caches"].setdefault(name, dict.fromkeys(CACHE_COUNTERS, 0))
+            for key in CACHE_COUNTERS:
+                into[key] += stats[key]
+    
+    def report(self):
+        """This process's counters, and those it took over, as written to its file"""
+        caches = {"catalog": catalog_cache.stats(), "card": card_cache.stats()}
+        total = {"pid": os.getpid(), "endpoints": {}, "caches": {}}
+        with self._lock:
+            self._dirty = False
+            self._add(total, self._inherited)
+            self._add(total, {"caches": caches, "endpoints": {
+                endpoint: {**stats, "requests": {f"{method} {status}": count
+                                                 for (method, status), count in stats["requests"].items()}}
+                for endpoint, stats in self._endpoints.items()}})
+        for name, stats in caches.items():
+            total["caches"][name]["size"] = stats["size"]
+        return total
+    
+    def flush(self):
+        """Write this process's report where the other workers read it"""
+        report = self.report()
+        os.makedirs(self.folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(report, f)
+        os.replace(tmp, os.path.join(self.folder, f"{process_key(report['pid'])}.json"))
+    
+    def _write_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._dirty:
+                continue
+            try:
+                with self._flush_lock:
+                    self.flush()
+            except OSError as e:
+                app.logger.warning("Could not write metrics to %s: %s", self.folder, e)
+    
+    def collect(self):
+        """Reports of every live process, after taking over those of processes that exited"""
+        with self._flush_lock:
+            claimed = []
+            for path in glob.glob(os.path.join(self.folder, "*.json")):
+                if process_alive(os.path.basename(path)[:-len(".json")]):
+                    continue
+                # Renaming claims the file, so only one process adds it to its own
+                try:
+                    os.rename(path, f"{path}.{os.getpid()}.claimed")
+                except OSError:
+                    continue
+                claimed.append(f"{path}.{os.getpid()}.claimed")
+                try:
+                    with open(claimed[-1]) as f:
+                        report = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                with self._lock:
+                    self._add(self._inherited, report)
+            self.flush()
+            for path in claimed:
+                os.remove(path)
+        
+        reports = []
+        for path in glob.glob(os.path.join(self.folder, "*.json")):
+            try:
+                with open(path) as f:
+                    reports.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return reports
+    
+    def exposition(self):
+        """All metrics, summed over worker processes, in the Prometheus text format"""
+        reports = self.collect()
+        total = {"endpoints": {}, "caches": {}}
+        for report in reports:
+            self._add(total, report)
+        endpoints = sorted(total["endpoints"].items())
+        lines = []
+        
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        metric("agro_http_requests_total", "counter", "Requests handled, by endpoint, method and status.")
+        for endpoint, stats in endpoints:
+            for key, count in sorted(stats["requests"].items()):
+                method, status = key.split(" ")
+                lines.append(f'agro_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+        
+        metric("agro_http_request_duration_seconds", "histogram", "Time from routing to the response being built.")
+        for endpoint, stats in endpoints:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), stats["buckets"]):
+                cumulative += count
+                lines.append(f'agro_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'agro_http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats["seconds"]:.6f}')
+            lines.append(f'agro_http_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+        
+        for name, key, help_text, fmt in (
+                ("agro_db_queries_total", "queries", "SQL statements executed.", "d"),
+                ("agro_db_query_seconds_total", "query_time", "Time spent executing SQL statements.", ".6f"),
+                ("agro_template_render_seconds_total", "render_time", "Time spent rendering templates.", ".6f"),
+                ("agro_http_response_bytes_total", "bytes", "Response body bytes, streamed responses excluded.", "d")):
+            metric(name, "counter", help_text)
+            for endpoint, stats in endpoints:
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {stats[key]:{fmt}}')
+        
+        for name, stats in sorted(total["caches"].items()):
+            for key in CACHE_COUNTERS:
+                metric(f"agro_{name}_cache_{key}_total", "counter", f"{name.title()} cache {key}.")
+                lines.append(f"agro_{name}_cache_{key}_total {stats[key]}")
+            metric(f"agro_{name}_cache_entries", "gauge", f"Entries held in the {name} cache, all workers.")
+            size = sum(report["caches"].get(name, {}).get("size", 0) for report in reports)
+            lines.append(f"agro_{name}_cache_entries {size}")
+        
+        metric("agro_worker_processes", "gauge", "Worker processes whose counters are included.")
+        lines.append(f"agro_worker_processes {len(reports)}")
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics(LATENCY_BUCKETS, METRICS_FOLDER, METRICS_FLUSH_INTERVAL)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.render_time = 0.0
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    if "render_start" in g:
+        g.render_time += time.perf_counter() - g.pop("render_start")
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get("request_start")
+    if start is not None:
+        conn = g.get("db")
+        request_metrics.record(request.endpoint or "unmatched", request.method, response.status_code,
+                               time.perf_counter() - start,
+                               conn.queries if conn else 0, conn.query_time if conn else 0.0,
+                               g.render_time, response.content_length or 0)
+    return response
+
+@app.cli.command("build-image-variants")
+@click.option("--force", is_flag=True, help="Rebuild variants that already exist.")
+def build_image_variants_command(force):
+    """Generate thumbnail, card and detail variants for existing product images."""
+    from PIL import Image
+    
+    conn = db()
+    built = skipped = failed = 0
+    
+    for row in conn.execute("SELECT DISTINCT image FROM products WHERE image IS NOT NULL"):
+        filename = row["image"]
+        if not force and has_image_variants(filename):
+            skipped += 1
+            continue
+        try:
+            make_image_variants(filename)
+            built += 1
+        except (OSError, Image.DecompressionBombError) as e:
+            click.echo(f"{filename}: {e}", err=True)
+            failed += 1
+    
+    click.echo(f"Built {built}, already present {skipped}, failed {failed}")
+
+@app.cli.command("gc-uploads")
+@click.option("--grace", default=UPLOAD_GC_GRACE, help="Keep unreferenced files younger than this many seconds.")
+@click.option("--dry-run", is_flag=True, help="List what would be removed without deleting.")
+def gc_uploads_command(grace, dry_run):
+    """Delete uploads, and their image variants, that no row references any more."""
+    conn = db()
+    referenced = {row["filename"] for row in conn.execute("SELECT filename FROM upload_refs WHERE refs > 0")}
+    cutoff = time.time() - grace
+    removed = freed = 0
+    
+    for entry in os.scandir(UPLOAD_FOLDER):
+        if not entry.is_file() or entry.name in referenced or entry.stat().st_mtime > cutoff:
+            continue
+        paths = [entry.path] + [os.path.join(VARIANT_FOLDER, variant_name(entry.name, variant, ext))
+                                for variant in IMAGE_VARIANTS for ext in ("jpg", "webp")]
+        for path in paths:
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                if dry_run:
+                    click.echo(path)
+                else:
+                    os.remove(path)
+        removed += 1
+    
+    if not dry_run:
+        conn.execute("DELETE FROM upload_refs WHERE refs <= 0")
+        conn.commit()
+    click.echo(f"{'Would remove' if dry_run else 'Removed'} {removed} upload(s), {freed / 1e6:.1f} MB")
+
+# ================= EMAIL OUTBOX =================
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETENTION_DAYS = 7
+# A claimed batch is hidden from other workers this long; past it, emails a
+# crashed worker never finished become due again. Covers a full batch of
+# 30 second SMTP timeouts.
+OUTBOX_CLAIM_SECONDS = 30 * OUTBOX_BATCH_SIZE
+
+def queue_email(conn, recipient, subject, body):
+    """Add an email to the outbox. It is only sent if the caller's transaction commits."""
+    conn.execute(
+        "INSERT INTO email_outbox(recipient, subject, body) VALUES(?,?,?)",
+        (recipient, subject, body)
+    )
+
+def outbox_backoff(attempts):
+    """Seconds before the next try: 30s doubling per attempt, capped at an hour, with jitter"""
+    return min(30 * 2 ** (attempts - 1), 3600) * random.uniform(0.8, 1.2)
+
+def _outbox_failed(conn, email, error):
+    attempts = email["attempts"] + 1
+    conn.execute("""
+        UPDATE email_outbox SET attempts=:attempts, last_error=:error, next_attempt_at=datetime('now', :backoff),
+               failed_at=CASE WHEN :attempts >= :max THEN CURRENT_TIMESTAMP END
+        WHERE id=:id
+    """, {"attempts": attempts, "error": str(error)[:500], "backoff": f"+{int(outbox_backoff(attempts))} seconds",
+          "max": OUTBOX_MAX_ATTEMPTS, "id": email["id"]})
+    conn.commit()
+    
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        app.logger.error("Giving up on email #%s to %s after %s attempts: %s",
+                         email["id"], email["recipient"], attempts, error)
+    else:
+        app.logger.warning("Email #%s to %s failed (attempt %s), will retry: %s",
+                           email["id"], email["recipient"], attempts, error)
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    """Send one batch of due outbox emails over a single SMTP connection. Returns how many were sent.
+
+    The batch is claimed first by moving its next_attempt_at past the claim
+    period, so workers running side by side (or an overlapping --once from
+    cron) never send the same email twice.
+    """
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    batch = conn.execute("""
+        SELECT id, recipient, subject, body, attempts FROM email_outbox
+        WHERE sent_at IS NULL AND failed_at IS NULL AND next_attempt_at <= CURRENT_TIMESTAMP
+        ORDER BY next_attempt_at
+        LIMIT ?
+    """, (batch_size,)).fetchall()
+    conn.executemany("UPDATE email_outbox SET next_attempt_at=datetime('now', ?) WHERE id=?",
+                     [(f"+{OUTBOX_CLAIM_SECONDS} seconds", email["id"]) for email in batch])
+    conn.commit()
+    if not batch:
+        return 0
+    
+    from flask_mail import Message
+    
+    sent = 0
+    pending = list(batch)
+    try:
+        with get_mail().connect() as smtp:
+            while pending:
+                email = pending[0]
+                try:
+                    smtp.send(Message(email["subject"], recipients=[email["recipient"]],
+                                      body=email["body"]))
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except smtplib.SMTPException as e:
+                    # Rejected by the server, the rest of the batch can still go
+                    pending.pop(0)
+                    _outbox_failed(conn, email, e)
+                    continue
+                
+                pending.pop(0)
+                conn.execute(
+                    "UPDATE email_outbox SET sent_at=CURRENT_TIMESTAMP, attempts=attempts+1 WHERE id=?",
+                    (email["id"],)
+                )
+                conn.commit()
+                sent += 1
+    except (smtplib.SMTPException, OSError) as e:
+        # Could not connect or the connection dropped, retry the rest later
+        for email in pending:
+            _outbox_failed(conn, email, e)
+    
+    return sent
+
+def purge_outbox():
+    """Delete emails sent, or given up on, more than OUTBOX_RETENTION_DAYS ago"""
+    conn = db()
+    for column in ("sent_at", "failed_at"):
+        conn.execute(f"DELETE FROM email_outbox WHERE {column} < datetime('now', ?)",
+                     (f"-{OUTBOX_RETENTION_DAYS} days",))
+    conn.commit()
+
+@app.cli.command("outbox-worker")
+@click.option("--once", is_flag=True, help="Send everything that is due, then exit.")
+@click.option("--interval", default=5.0, help="Seconds to wait when nothing is due.")
+def outbox_worker(once, interval):
+    """Send queued emails from the outbox."""
+    socket.setdefaulttimeout(30)
+    
+    while True:
+        while drain_outbox():
+            pass
+        purge_outbox()
+        
+        if once:
+            break
+        time.sleep(interval)
+
+# ================= PASSWORD HASHING =================
+# Password hashing is slow on purpose, so a burst of logins could take every
+# core. Hashes run on a small pool instead, using at most HASH_WORKERS cores;
+# once HASH_QUEUE_DEPTH more are waiting, further attempts get a 429 at once.
+PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+HASH_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+HASH_QUEUE_DEPTH = 16
+
+_hash_pool = None
+_hash_pool_pid = None
+_hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_DEPTH)
+
+def _hashing(fn, *args):
+    global _hash_pool, _hash_pool_pid
+    if not _hash_slots.acquire(blocking=False):
+        raise TooManyRequests("The server is busy, please try again in a moment.", retry_after=2)
+    try:
+        if _hash_pool_pid != os.getpid():
+            # Pool threads do not survive a fork, start a fresh pool in the child
+            _hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash")
+            _hash_pool_pid = os.getpid()
+        future = _hash_pool.submit(fn, *args)
+    except BaseException:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return future.result()
+
+def hash_password(password):
+    """generate_password_hash() on the hashing pool; raises TooManyRequests when it is full"""
+    return _hashing(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(stored, password):
+    """check_password_hash() on the hashing pool; raises TooManyRequests when it is full"""
+    return _hashing(check_password_hash, stored, password)
+
+def needs_rehash(stored):
+    """True for hashes made with other parameters than PASSWORD_HASH_METHOD"""
+    return stored.split("$", 1)[0] != PASSWORD_HASH_METHOD
+
+class TokenBucket:
+    """Per-key token buckets in memory: burst attempts at once, refilled at rate per second.
+
+    Least recently used keys are dropped past maxkeys; a dropped key starts
+    over with a full bucket. Each worker process keeps its own buckets.
+    """
+    def __init__(self, rate, burst, maxkeys=100_000):
+        self.rate = rate
+        self.burst = burst
+        self.maxkeys = maxkeys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key):
+        """Spend a token for key; returns 0 if there was one, else the seconds until there is"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxkeys:
+                self._buckets.popitem(last=False)
+        return wait
+
+# Credential attempts (login, register, password reset and change) per client
+# address, and per account on top of that
+ip_attempts = TokenBucket(rate=10 / 60, burst=20)
+account_attempts = TokenBucket(rate=5 / 300, burst=5)
+
+def limit_attempts(*accounts):
+    """Raise TooManyRequests when this client or any of these accounts is out of attempts"""
+    wait = ip_attempts.take(request.remote_addr)
+    for account in accounts:
+        wait = max(wait, account_attempts.take(account))
+    if wait:
+        raise TooManyRequests(f"Too many attempts, please try again in {math.ceil(wait)} seconds.",
+                              retry_after=math.ceil(wait))
 
 # ================= DECORATORS =================
 def login_required(f):
@@ -170,6 +1762,61 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+@app.template_global()
+def csrf_token():
+    """Per-session token that forms send back as csrf_token and JSON API calls in X-CSRF-Token"""
+    if "csrf_token" not in session:
+        session["csrf_token"] = secrets.token_urlsafe(32)
+    return session["csrf_token"]
+
+def api_login_required(f):
+    """login_required for JSON endpoints: errors come back as JSON, and the CSRF token must match"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if "user_id" not in session:
+            return jsonify(error="Please login to continue"), 401
+        token = request.headers.get("X-CSRF-Token", "")
+        if not token or not secrets.compare_digest(token, session.get("csrf_token", "")):
+            return jsonify(error="Session expired, please reload the page"), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def csrf_required(f):
+    """For POST routes behind login_required: the form's csrf_token must match the session's"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = request.form.get("csrf_token", "")
+        if not token or not secrets.compare_digest(token, session.get("csrf_token", "")):
+            flash("Session expired, please try again", "danger")
+            return redirect(request.referrer or "/products")
+        return f(*args, **kwargs)
+    return decorated_function
+
+def set_badges(**counts):
+    """Update the navbar badge counts in the session.
+
+    The session is only marked modified, and a new cookie sent, when a count
+    actually changed.
+    """
+    badges = {**session.get("badges", {}), **counts}
+    if badges != session.get("badges"):
+        session["badges"] = badges
+
+def refresh_badges(conn):
+    """Recount the navbar cart and wishlist badges into the session.
+
+    Pages render the badges from the session, so they cost no query per page;
+    anything that changes the customer's cart or wishlist calls this, as do
+    login and the cart and wishlist pages. Changes made outside this session
+    (a product deleted by the admin, a checkout in another browser) show up
+    at the next of those.
+    """
+    row = conn.execute("""
+        SELECT (SELECT COALESCE(SUM(quantity), 0) FROM cart WHERE user_id=:user) AS cart,
+               (SELECT COUNT(*) FROM wishlist WHERE user_id=:user) AS wishlist
+    """, {"user": session["user_id"]}).fetchone()
+    set_badges(cart=row["cart"], wishlist=row["wishlist"])
+
 # ================= AUTH =================
 @app.route("/")
 def home():
@@ -179,6 +1826,18 @@ def home():
         return redirect("/products")
     return redirect("/login")
 
+def rehash(conn, table, account, password):
+    """Store a fresh hash after a successful login if the stored one uses old parameters"""
+    if not needs_rehash(account["password"]):
+        return
+    try:
+        hashed = hash_password(password)
+    except TooManyRequests:
+        return  # next login will do it
+    conn.execute(f"UPDATE {table} SET password=? WHERE id=? AND password=?",
+                 (hashed, account["id"], account["password"]))
+    conn.commit()
+
 @app.route("/login", methods=["GET","POST"])
 def login():
     if request.method=="POST":
@@ -190,6 +1849,9 @@ def login():
             flash("All fields are required", "danger")
             return render_template("login.html")
 
+        # Only "admin" selects the admin table; any other role value logs in a
+        # customer, so it must not buy a fresh bucket for the same account
+        limit_attempts(f"admin:{email.lower()}" if role == "admin" else f"user:{email.lower()}")
         conn = db()
 
         if role == "admin":
@@ -197,7 +1859,8 @@ def login():
                 "SELECT * FROM admin WHERE username=?", (email,)
             ).fetchone()
             
-            if admin and check_password_hash(admin["password"], password):
+            if admin and verify_password(admin["password"], password):
+                rehash(conn, "admin", admin, password)
                 session.clear()
                 session["admin"] = True
                 session["admin_id"] = admin["id"]
@@ -214,10 +1877,12 @@ def login():
                 "SELECT * FROM users WHERE email=?", (email,)
             ).fetchone()
             
-            if user and check_password_hash(user["password"], password):
+            if user and verify_password(user["password"], password):
+                rehash(conn, "users", user, password)
                 session.clear()
                 session["user_id"] = user["id"]
                 session["user_name"] = user["name"]
+                refresh_badges(conn)
                 flash(f"Welcome back, {user['name']}!", "success")
                 conn.close()
                 return redirect("/products")
@@ -252,6 +1917,7 @@ def register():
             flash("Passwords do not match", "danger")
             return render_template("register.html")
 
+        limit_attempts()
         conn = db()
         
         # Check if email already exists
@@ -261,7 +1927,7 @@ def register():
             return render_template("register.html")
 
         # Hash password and insert user
-        hashed = generate_password_hash(password)
+        hashed = hash_password(password)
         conn.execute(
             "INSERT INTO users(name, email, password) VALUES(?,?,?)",
             (name, email, hashed)
@@ -283,6 +1949,7 @@ def forgot_password():
             flash("Invalid email format", "danger")
             return render_template("forgot_password.html")
 
+        limit_attempts(f"user:{email.lower()}")
         conn = db()
         user = conn.execute("SELECT * FROM users WHERE email=?", (email,)).fetchone()
         
@@ -295,13 +1962,10 @@ def forgot_password():
                 "INSERT INTO password_reset(email, token, expires_at) VALUES(?,?,?)",
                 (email, token, expires)
             )
-            conn.commit()
             
-            # Send email (you need to configure SMTP)
-            try:
-                msg = Message("Password Reset Request", recipients=[email])
-                reset_link = f"http://localhost:5000/reset_password/{token}"
-                msg.body = f"""
+            # Queue the email with the token, the outbox worker sends it
+            reset_link = f"http://localhost:5000/reset_password/{token}"
+            queue_email(conn, email, "Password Reset Request", f"""
 Hello,
 
 You requested a password reset. Click the link below to reset your password:
@@ -311,11 +1975,9 @@ You requested a password reset. Click the link below to reset your password:
 This link will expire in 1 hour.
 
 If you didn't request this, please ignore this email.
-                """
-                mail.send(msg)
-                flash("Password reset link sent to your email", "success")
-            except:
-                flash("Email service not configured. Contact admin.", "warning")
+                """)
+            conn.commit()
+            flash("Password reset link sent to your email", "success")
         else:
             # Don't reveal if email exists or not (security)
             flash("If the email exists, a reset link has been sent", "info")
@@ -350,7 +2012,8 @@ def reset_password(token):
             flash("Passwords do not match", "danger")
             return render_template("reset_password.html", token=token)
         
-        hashed = generate_password_hash(password)
+        limit_attempts(f"user:{reset_req['email'].lower()}")
+        hashed = hash_password(password)
         conn.execute("UPDATE users SET password=? WHERE email=?", 
                     (hashed, reset_req["email"]))
         conn.execute("UPDATE password_reset SET used=1 WHERE id=?", 
@@ -375,55 +2038,86 @@ def products():
     category = request.args.get("category", "")
     min_price = request.args.get("min_price", "")
     max_price = request.args.get("max_price", "")
-    sort = request.args.get("sort", "newest")
+    match = fts_query(search)
+    sort = request.args.get("sort") or ("relevance" if match else "newest")
+    if sort not in CATALOG_SORTS or (sort == "relevance" and not match):
+        sort = "newest"
+    sort_key, direction = CATALOG_SORTS[sort]
+    
+    per_page = request.args.get("per_page", CATALOG_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, CATALOG_MAX_PAGE_SIZE))
     
-    # Base query
-    query = "SELECT * FROM products WHERE 1=1"
+    # Get wishlist items for current user
+    wishlist_ids = [row["product_id"] for row in conn.execute(
+        "SELECT product_id FROM wishlist WHERE user_id=? ORDER BY product_id", 
+        (session["user_id"],)
+    ).fetchall()]
+    
+    # The page only changes with the catalog or this user's wishlist. Stock
+    # and ratings move without a new catalog version, so the tag also expires
+    # with the catalog cache TTL
+    etag = page_etag("products", catalog_version(conn), int(time.time() // CATALOG_CACHE_TTL),
+                     request.full_path, session["user_id"], wishlist_ids)
+    if client_has(etag):
+        conn.close()
+        return revalidate(Response(status=304), etag)
+    
+    # Base query, searches go through the full-text index
+    query = f"SELECT products.*, {sort_key} AS sort_value FROM products"
     params = []
     
-    # Apply filters
-    if search:
-        query += " AND (name LIKE ? OR description LIKE ?)"
-        params.extend([f"%{search}%", f"%{search}%"])
+    if match:
+        query += " JOIN products_fts ON products_fts.rowid = products.id WHERE products_fts MATCH ?"
+        params.append(match)
+    else:
+        query += " WHERE 1=1"
     
+    # Apply filters
     if category:
-        query += " AND category=?"
+        query += " AND products.category=?"
         params.append(category)
     
     if min_price:
-        query += " AND price >= ?"
+        query += " AND products.price >= ?"
         params.append(float(min_price))
     
     if max_price:
-        query += " AND price <= ?"
+        query += " AND products.price <= ?"
         params.append(float(max_price))
     
+    # Keyset pagination: continue after the (sort value, id) of the last row
+    # shown, so any page costs the same as the first one
+    cursor = decode_cursor(request.args.get("cursor", ""))
+    if cursor and len(cursor) == 3 and cursor[0] == sort:
+        query += f" AND ({sort_key}, products.id) {'<' if direction == 'DESC' else '>'} (?, ?)"
+        params.extend(cursor[1:])
+    
     # Apply sorting
-    if sort == "price_low":
-        query += " ORDER BY price ASC"
-    elif sort == "price_high":
-        query += " ORDER BY price DESC"
-    elif sort == "name":
-        query += " ORDER BY name ASC"
-    else:  # newest
-        query += " ORDER BY created_at DESC"
+    query += f" ORDER BY {sort_key} {direction}, products.id {direction} LIMIT ?"
+    params.append(per_page + 1)
     
-    products = conn.execute(query, params).fetchall()
+    # Plain browsing pages are shared by every customer; searches are too varied to cache
+    if match:
+        products = conn.execute(query, params).fetchall()
+    else:
+        products = cached_catalog(conn, ("products", query, tuple(params)),
+                                  lambda: conn.execute(query, params).fetchall())
+    
+    next_cursor = None
+    if len(products) > per_page:
+        products = products[:per_page]
+        last = products[-1]
+        next_cursor = encode_cursor(sort, last["sort_value"], last["id"])
+    first_url, next_url = page_links("products", next_cursor)
     
     # Get all categories for filter dropdown
-    categories = conn.execute(
+    categories = cached_catalog(conn, ("categories",), lambda: conn.execute(
         "SELECT DISTINCT category FROM products ORDER BY category"
-    ).fetchall()
-    
-    # Get wishlist items for current user
-    wishlist_ids = [row["product_id"] for row in conn.execute(
-        "SELECT product_id FROM wishlist WHERE user_id=?", 
-        (session["user_id"],)
-    ).fetchall()]
+    ).fetchall())
     
     conn.close()
     
-    return render_template("products.html", 
+    return revalidate(make_response(render_template("products.html", 
                          products=products, 
                          categories=categories,
                          wishlist_ids=wishlist_ids,
@@ -431,12 +2125,17 @@ def products():
                          category=category,
                          min_price=min_price,
                          max_price=max_price,
-                         sort=sort)
+                         sort=sort,
+                         first_url=first_url,
+                         next_url=next_url)), etag)
 
 @app.route("/product/<int:pid>")
 @login_required
 def product_details(pid):
     conn = db()
+    # Read fresh, not through the catalog cache: the page shows the exact stock
+    # and rating, which change without a new catalog version, and a primary
+    # key lookup costs no more than reading the version
     product = conn.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
     
     if not product:
@@ -444,42 +2143,56 @@ def product_details(pid):
         conn.close()
         return redirect("/products")
     
-    # Get reviews for this product
-    reviews = conn.execute("""
+    # Per-customer state, never cached
+    user_reviewed, in_wishlist = conn.execute("""
+        SELECT EXISTS(SELECT 1 FROM reviews WHERE product_id=? AND user_id=?),
+               EXISTS(SELECT 1 FROM wishlist WHERE product_id=? AND user_id=?)
+    """, (pid, session["user_id"], pid, session["user_id"])).fetchone()
+    
+    # Reviews and rating changes touch updated_at too, through the rating triggers
+    etag = page_etag("product", pid, product["updated_at"], request.full_path,
+                     session["user_id"], user_reviewed, in_wishlist)
+    last_modified = datetime.strptime(product["updated_at"][:19], "%Y-%m-%d %H:%M:%S")
+    if client_has(etag):
+        conn.close()
+        return revalidate(Response(status=304), etag, last_modified)
+    
+    # One page of reviews, newest first, continuing after the cursor
+    query = """
         SELECT reviews.*, users.name as user_name
         FROM reviews
         JOIN users ON reviews.user_id = users.id
         WHERE reviews.product_id = ?
-        ORDER BY reviews.created_at DESC
-    """, (pid,)).fetchall()
-    
-    # Calculate average rating
-    avg_rating = conn.execute(
-        "SELECT AVG(rating) as avg FROM reviews WHERE product_id=?", (pid,)
-    ).fetchone()["avg"]
+    """
+    params = [pid]
     
-    avg_rating = round(avg_rating, 1) if avg_rating else 0
+    cursor = decode_cursor(request.args.get("cursor"))
+    if cursor and len(cursor) == 2:
+        query += " AND (reviews.created_at, reviews.id) < (?, ?)"
+        params.extend(cursor)
     
-    # Check if user already reviewed
-    user_review = conn.execute(
-        "SELECT * FROM reviews WHERE product_id=? AND user_id=?",
-        (pid, session["user_id"])
-    ).fetchone()
+    query += " ORDER BY reviews.created_at DESC, reviews.id DESC LIMIT ?"
+    params.append(REVIEWS_PAGE_SIZE + 1)
+    reviews = conn.execute(query, params).fetchall()
+    conn.close()
     
-    # Check if in wishlist
-    in_wishlist = conn.execute(
-        "SELECT * FROM wishlist WHERE product_id=? AND user_id=?",
-        (pid, session["user_id"])
-    ).fetchone() is not None
+    next_cursor = None
+    if len(reviews) > REVIEWS_PAGE_SIZE:
+        reviews = reviews[:REVIEWS_PAGE_SIZE]
+        next_cursor = encode_cursor(reviews[-1]["created_at"], reviews[-1]["id"])
+    first_url, next_url = page_links("product_details", next_cursor)
     
-    conn.close()
+    # Average rating from the aggregates kept on the product row
+    avg_rating = round(product["rating_sum"] / product["rating_count"], 1) if product["rating_count"] else 0
     
-    return render_template("product_details.html", 
+    return revalidate(make_response(render_template("product_details.html", 
                          product=product, 
                          reviews=reviews,
                          avg_rating=avg_rating,
-                         user_review=user_review,
-                         in_wishlist=in_wishlist)
+                         user_review=user_reviewed,
+                         in_wishlist=in_wishlist,
+                         first_url=first_url,
+                         next_url=next_url)), etag, last_modified)
 
 @app.route("/add_review/<int:pid>", methods=["POST"])
 @login_required
@@ -527,47 +2240,50 @@ def wishlist():
         ORDER BY wishlist.added_at DESC
     """, (session["user_id"],)).fetchall()
     conn.close()
+    set_badges(wishlist=len(items))
     
     return render_template("wishlist.html", items=items)
 
-@app.route("/add_to_wishlist/<int:pid>")
+@app.route("/add_to_wishlist/<int:pid>", methods=["POST"])
 @login_required
+@csrf_required
 def add_to_wishlist(pid):
     conn = db()
     
-    existing = conn.execute(
-        "SELECT * FROM wishlist WHERE user_id=? AND product_id=?",
+    # The unique (user_id, product_id) index turns a duplicate into a no-op
+    added = conn.execute(
+        "INSERT OR IGNORE INTO wishlist(user_id, product_id) VALUES(?,?)",
         (session["user_id"], pid)
-    ).fetchone()
+    ).rowcount
+    conn.commit()
     
-    if existing:
-        flash("Product already in wishlist", "info")
-    else:
-        conn.execute(
-            "INSERT INTO wishlist(user_id, product_id) VALUES(?,?)",
-            (session["user_id"], pid)
-        )
-        conn.commit()
+    if added:
         flash("Added to wishlist", "success")
+    else:
+        flash("Product already in wishlist", "info")
     
+    refresh_badges(conn)
     conn.close()
     return redirect(request.referrer or "/products")
 
-@app.route("/remove_from_wishlist/<int:wid>")
+@app.route("/remove_from_wishlist/<int:wid>", methods=["POST"])
 @login_required
+@csrf_required
 def remove_from_wishlist(wid):
     conn = db()
     conn.execute("DELETE FROM wishlist WHERE id=? AND user_id=?", 
                 (wid, session["user_id"]))
     conn.commit()
+    refresh_badges(conn)
     conn.close()
     
     flash("Removed from wishlist", "success")
     return redirect("/wishlist")
 
 # ================= CART =================
-@app.route("/add_to_cart/<int:pid>")
+@app.route("/add_to_cart/<int:pid>", methods=["POST"])
 @login_required
+@csrf_required
 def add_to_cart(pid):
     conn = db()
     
@@ -595,17 +2311,20 @@ def add_to_cart(pid):
             flash("Cart updated", "success")
     else:
         conn.execute(
-            "INSERT INTO cart(user_id, product_id, quantity) VALUES(?,?,1)", 
+            "INSERT INTO cart(user_id, product_id, quantity) VALUES(?,?,1) "
+            "ON CONFLICT(user_id, product_id) DO NOTHING", 
             (session["user_id"], pid)
         )
         conn.commit()
         flash("Added to cart", "success")
 
+    refresh_badges(conn)
     conn.close()
     return redirect(request.referrer or "/cart")
 
-@app.route("/buy_now/<int:pid>")
+@app.route("/buy_now/<int:pid>", methods=["POST"])
 @login_required
+@csrf_required
 def buy_now(pid):
     conn = db()
     
@@ -623,6 +2342,7 @@ def buy_now(pid):
         (session["user_id"], pid)
     )
     conn.commit()
+    refresh_badges(conn)
     conn.close()
     
     return redirect("/payment")
@@ -640,12 +2360,14 @@ def cart():
     """, (session["user_id"],)).fetchall()
     
     total = sum(item["price"] * item["quantity"] for item in cart_items)
+    set_badges(cart=sum(item["quantity"] for item in cart_items))
     
     conn.close()
     return render_template("cart.html", cart=cart_items, total=total)
 
-@app.route("/update_cart/<int:cid>/<action>")
+@app.route("/update_cart/<int:cid>/<action>", methods=["POST"])
 @login_required
+@csrf_required
 def update_cart(cid, action):
     conn = db()
     
@@ -654,27 +2376,276 @@ def update_cart(cid, action):
             SELECT cart.quantity, products.stock 
             FROM cart 
             JOIN products ON cart.product_id = products.id
-            WHERE cart.id=?
-        """, (cid,)).fetchone()
+            WHERE cart.id=? AND cart.user_id=?
+        """, (cid, session["user_id"])).fetchone()
         
         if cart_item and cart_item["quantity"] < cart_item["stock"]:
-            conn.execute("UPDATE cart SET quantity=quantity+1 WHERE id=?", (cid,))
+            conn.execute("UPDATE cart SET quantity=quantity+1 WHERE id=? AND user_id=?",
+                         (cid, session["user_id"]))
             flash("Quantity updated", "success")
         else:
             flash("Stock limit reached", "warning")
     elif action == "dec":
-        conn.execute("UPDATE cart SET quantity=quantity-1 WHERE id=?", (cid,))
-        conn.execute("DELETE FROM cart WHERE id=? AND quantity<=0", (cid,))
+        conn.execute("UPDATE cart SET quantity=quantity-1 WHERE id=? AND user_id=?",
+                     (cid, session["user_id"]))
+        conn.execute("DELETE FROM cart WHERE id=? AND user_id=? AND quantity<=0",
+                     (cid, session["user_id"]))
         flash("Quantity updated", "success")
     elif action == "remove":
-        conn.execute("DELETE FROM cart WHERE id=?", (cid,))
+        conn.execute("DELETE FROM cart WHERE id=? AND user_id=?", (cid, session["user_id"]))
         flash("Item removed from cart", "success")
     
     conn.commit()
     conn.close()
     return redirect("/cart")
 
+# ================= CART & WISHLIST API =================
+# JSON counterparts of the cart and wishlist buttons, used by main.js to update
+# the page in place. Each change is one conditional statement; one read then
+# returns the line, cart totals and badge counts the page needs.
+CART_STATE_QUERY = """
+    SELECT products.price, products.stock,
+           (SELECT quantity FROM cart WHERE user_id=:user AND product_id=products.id) AS quantity,
+           EXISTS(SELECT 1 FROM wishlist WHERE user_id=:user AND product_id=products.id) AS in_wishlist,
+           (SELECT COUNT(*) FROM cart WHERE user_id=:user) AS cart_lines,
+           (SELECT COALESCE(SUM(quantity), 0) FROM cart WHERE user_id=:user) AS cart_quantity,
+           (SELECT COALESCE(SUM(cart.quantity * line.price), 0)
+            FROM cart JOIN products AS line ON line.id = cart.product_id
+            WHERE cart.user_id=:user) AS cart_total,
+           (SELECT COUNT(*) FROM wishlist WHERE user_id=:user) AS wishlist_count
+    FROM products WHERE products.id=:product
+"""
+
+def cart_state(conn, pid, message, conflict=False):
+    """JSON response with a product's cart line and wishlist flag, the cart totals and badge counts.
+
+    conflict=True means the change was refused for lack of stock (409).
+    """
+    row = conn.execute(CART_STATE_QUERY, {"user": session["user_id"], "product": pid}).fetchone()
+    if row is None:
+        return jsonify(error="Product not found"), 404
+    set_badges(cart=row["cart_quantity"], wishlist=row["wishlist_count"])
+    
+    quantity = row["quantity"] or 0
+    body = {
+        "message": message,
+        "line": {"product_id": pid, "quantity": quantity, "stock": row["stock"],
+                 "subtotal": round(quantity * row["price"], 2)},
+        "cart": {"lines": row["cart_lines"], "quantity": row["cart_quantity"],
+                 "total": round(row["cart_total"], 2)},
+        "wishlist": {"count": row["wishlist_count"], "in_wishlist": bool(row["in_wishlist"])},
+    }
+    if conflict:
+        body["error"] = body["message"] = ("Product out of stock" if row["stock"] <= 0
+                                           else f"Only {row['stock']} in stock")
+        return jsonify(body), 409
+    return jsonify(body)
+
+@app.route("/api/cart/<int:pid>", methods=["POST"])
+@api_login_required
+def api_cart(pid):
+    """{"quantity": n} sets the product's cart line (0 removes it); {"add": n}, by default 1, adds to it"""
+    data = request.get_json(silent=True) or {}
+    setting = "quantity" in data
+    try:
+        quantity = int(data["quantity"] if setting else data.get("add", 1))
+    except (TypeError, ValueError):
+        return jsonify(error="Quantity must be a whole number"), 400
+    if quantity < 0 or (not setting and quantity == 0):
+        return jsonify(error="Quantity out of range"), 400
+    
+    conn = db()
+    user_id = session["user_id"]
+    if setting and quantity == 0:
+        conn.execute("DELETE FROM cart WHERE user_id=? AND product_id=?", (user_id, pid))
+        changed, message = True, "Item removed from cart"
+    elif setting:
+        changed = conn.execute("""
+            INSERT INTO cart(user_id, product_id, quantity)
+            SELECT ?, id, ? FROM products WHERE id=? AND stock >= ?
+            ON CONFLICT(user_id, product_id) DO UPDATE SET quantity=excluded.quantity
+        """, (user_id, quantity, pid, quantity)).rowcount
+        message = "Quantity updated"
+    else:
+        changed = conn.execute("""
+            INSERT INTO cart(user_id, product_id, quantity)
+            SELECT ?, id, ? FROM products WHERE id=? AND stock >= ?
+            ON CONFLICT(user_id, product_id) DO UPDATE SET quantity=quantity + excluded.quantity
+            WHERE quantity + excluded.quantity <= (SELECT stock FROM products WHERE id=excluded.product_id)
+        """, (user_id, quantity, pid, quantity)).rowcount
+        message = "Added to cart"
+    conn.commit()
+    
+    return cart_state(conn, pid, message, conflict=not changed)
+
+CART_MAX_LINES = 200
+
+@app.route("/api/cart", methods=["POST"])
+@api_login_required
+def api_cart_replace():
+    """Make the cart exactly {"items": {product_id: quantity}}; lines left out or set to 0 are removed.
+
+    Stock for every line is checked in one query and the whole basket is
+    written in one transaction, so either every line applies or none does.
+    """
+    items = (request.get_json(silent=True) or {}).get("items")
+    if not isinstance(items, dict):
+        return jsonify(error="items must map product ids to quantities"), 400
+    try:
+        basket = {int(pid): int(quantity) for pid, quantity in items.items()}
+    except (TypeError, ValueError):
+        return jsonify(error="Product ids and quantities must be whole numbers"), 400
+    if any(quantity < 0 for quantity in basket.values()):
+        return jsonify(error="Quantity out of range"), 400
+    basket = {pid: quantity for pid, quantity in basket.items() if quantity > 0}
+    if len(basket) > CART_MAX_LINES:
+        return jsonify(error=f"A cart can hold at most {CART_MAX_LINES} products"), 400
+    
+    conn = db()
+    user_id = session["user_id"]
+    marks = ",".join("?" * len(basket))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        products = {row["id"]: row for row in conn.execute(
+            f"SELECT id, name, price, stock FROM products WHERE id IN ({marks})", list(basket))}
+        problems = [{"product_id": pid, "requested": quantity,
+                     "stock": products[pid]["stock"] if pid in products else 0}
+                    for pid, quantity in basket.items()
+                    if pid not in products or quantity > products[pid]["stock"]]
+        if problems:
+            conn.rollback()
+            names = ", ".join(products[p["product_id"]]["name"] if p["product_id"] in products
+                              else f"#{p['product_id']}" for p in problems)
+            return jsonify(error=f"Not enough stock for {names}", problems=problems), 409
+        
+        conn.execute(f"DELETE FROM cart WHERE user_id=? AND product_id NOT IN ({marks})", [user_id, *basket])
+        conn.executemany("""
+            INSERT INTO cart(user_id, product_id, quantity) VALUES(?,?,?)
+            ON CONFLICT(user_id, product_id) DO UPDATE SET quantity=excluded.quantity
+        """, [(user_id, pid, quantity) for pid, quantity in basket.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    lines = [{"product_id": pid, "quantity": quantity, "stock": products[pid]["stock"],
+              "subtotal": round(quantity * products[pid]["price"], 2)}
+             for pid, quantity in basket.items()]
+    quantity = sum(basket.values())
+    set_badges(cart=quantity)
+    return jsonify(message="Cart updated", lines=lines,
+                   cart={"lines": len(lines), "quantity": quantity,
+                         "total": round(sum(line["subtotal"] for line in lines), 2)})
+
+@app.route("/api/wishlist/<int:pid>", methods=["POST"])
+@api_login_required
+def api_wishlist(pid):
+    """{"wishlisted": true} adds the product to the wishlist, false removes it"""
+    data = request.get_json(silent=True) or {}
+    wishlisted = data.get("wishlisted")
+    if not isinstance(wishlisted, bool):
+        return jsonify(error="wishlisted must be true or false"), 400
+    
+    conn = db()
+    if wishlisted:
+        conn.execute("INSERT OR IGNORE INTO wishlist(user_id, product_id) SELECT ?, id FROM products WHERE id=?",
+                     (session["user_id"], pid))
+        message = "Added to wishlist"
+    else:
+        conn.execute("DELETE FROM wishlist WHERE user_id=? AND product_id=?", (session["user_id"], pid))
+        message = "Removed from wishlist"
+    conn.commit()
+    
+    return cart_state(conn, pid, message)
+
 # ================= PAYMENT & ORDERS =================
+CHECKOUT_ATTEMPTS = 4
+
+class CheckoutError(Exception):
+    """Checkout could not complete; the message is flashed to the customer"""
+    def __init__(self, message, category="danger"):
+        super().__init__(message)
+        self.category = category
+
+def place_order(conn, user_id, payment_method):
+    """Turn the user's cart into one order and return its id.
+
+    Runs in a BEGIN IMMEDIATE transaction so concurrent checkouts queue for
+    the write lock up front instead of failing when a read lock upgrades.
+    Stock is taken with conditional decrements, so two carts racing for the
+    last units cannot both succeed. If the lock is still busy after
+    busy_timeout, retries with jittered backoff before giving up.
+    """
+    for attempt in range(1, CHECKOUT_ATTEMPTS + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return _place_order(conn, user_id, payment_method)
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            if attempt == CHECKOUT_ATTEMPTS:
+                raise CheckoutError("The store is busy right now, please try again") from e
+            time.sleep(0.05 * 2 ** attempt * random.uniform(0.5, 1.5))
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+def _place_order(conn, user_id, payment_method):
+    items = conn.execute("""
+        SELECT cart.product_id, cart.quantity, products.price, products.category
+        FROM cart 
+        JOIN products ON cart.product_id=products.id
+        WHERE cart.user_id=?
+    """, (user_id,)).fetchall()
+    
+    if not items:
+        raise CheckoutError("Your cart is empty", "warning")
+    
+    # Take stock only where enough is left; a short rowcount means a line lost the race
+    taken = conn.executemany(
+        "UPDATE products SET stock = stock - ? WHERE id=? AND stock >= ?",
+        [(item["quantity"], item["product_id"], item["quantity"]) for item in items]
+    ).rowcount
+    if taken != len(items):
+        raise CheckoutError("Insufficient stock for some items")
+    
+    # One order for the whole cart, one line per product
+    total = sum(item["quantity"] * item["price"] for item in items)
+    order_id = conn.execute(
+        "INSERT INTO orders(user_id, total_price, status, payment_method) VALUES(?,?,?,?)",
+        (user_id, total, "confirmed", payment_method)
+    ).lastrowid
+    conn.executemany(
+        "INSERT INTO order_items(order_id, product_id, quantity, unit_price, total_price, category) "
+        "VALUES(?,?,?,?,?,?)",
+        [(order_id, item["product_id"], item["quantity"], item["price"],
+          item["quantity"] * item["price"], item["category"]) for item in items]
+    )
+    
+    record_sales(conn, order_id)
+    
+    # Clear cart
+    conn.execute("DELETE FROM cart WHERE user_id=?", (user_id,))
+    
+    # Order confirmation email, committed together with the order
+    user = conn.execute("SELECT email, name FROM users WHERE id=?", (user_id,)).fetchone()
+    
+    queue_email(conn, user["email"], "Order Confirmation", f"""
+Hello {user["name"]},
+
+Your order #{order_id} has been confirmed!
+
+Payment Method: {payment_method}
+Total Items: {len(items)}
+
+Thank you for shopping with us!
+        """)
+    conn.commit()
+    return order_id
+
 @app.route("/payment", methods=["GET","POST"])
 @login_required
 def payment():
@@ -685,65 +2656,13 @@ def payment():
             flash("Please select a payment method", "danger")
             return redirect("/payment")
         
-        conn = db()
-        
-        # Get cart items
-        items = conn.execute("""
-            SELECT cart.product_id, cart.quantity, products.price, products.stock
-            FROM cart 
-            JOIN products ON cart.product_id=products.id
-            WHERE cart.user_id=?
-        """, (session["user_id"],)).fetchall()
-        
-        if not items:
-            flash("Your cart is empty", "warning")
-            conn.close()
-            return redirect("/cart")
-        
-        # Validate stock availability
-        for item in items:
-            if item["quantity"] > item["stock"]:
-                flash(f"Insufficient stock for some items", "danger")
-                conn.close()
-                return redirect("/cart")
-        
-        # Create orders and update stock
-        for item in items:
-            conn.execute(
-                "INSERT INTO orders(user_id, product_id, quantity, total_price, status) VALUES(?,?,?,?,?)",
-                (session["user_id"], item["product_id"], item["quantity"], 
-                 item["quantity"] * item["price"], "confirmed")
-            )
-            conn.execute(
-                "UPDATE products SET stock = stock - ? WHERE id=?",
-                (item["quantity"], item["product_id"])
-            )
-        
-        # Clear cart
-        conn.execute("DELETE FROM cart WHERE user_id=?", (session["user_id"],))
-        conn.commit()
-        
-        # Send order confirmation email
-        user = conn.execute("SELECT email, name FROM users WHERE id=?", 
-                          (session["user_id"],)).fetchone()
-        
         try:
-            msg = Message("Order Confirmation", recipients=[user["email"]])
-            msg.body = f"""
-Hello {user["name"]},
-
-Your order has been confirmed!
-
-Payment Method: {payment_method}
-Total Items: {len(items)}
-
-Thank you for shopping with us!
-            """
-            mail.send(msg)
-        except:
-            pass  # Email service not configured
+            place_order(db(), session["user_id"], payment_method)
+        except CheckoutError as e:
+            flash(str(e), e.category)
+            return redirect("/cart")
         
-        conn.close()
+        refresh_badges(db())
         flash("Order placed successfully!", "success")
         return redirect("/payment_success")
     
@@ -771,35 +2690,28 @@ def payment_success():
 def orders():
     conn = db()
     orders = conn.execute("""
-        SELECT orders.id, products.name, products.image, orders.quantity, 
-               orders.total_price, orders.status, orders.order_date
+        SELECT orders.id, orders.total_price, orders.status, orders.order_date
         FROM orders 
-        JOIN products ON orders.product_id=products.id
         WHERE orders.user_id=?
         ORDER BY orders.order_date DESC
     """, (session["user_id"],)).fetchall()
+    items = order_lines(conn, [order["id"] for order in orders])
     conn.close()
     
-    return render_template("orders.html", orders=orders)
+    return render_template("orders.html", orders=orders, items=items)
 
-@app.route("/download_invoice/<int:order_id>")
-@login_required
-def download_invoice(order_id):
-    conn = db()
-    order = conn.execute("""
-        SELECT orders.*, products.name as product_name, users.name as user_name, users.email
-        FROM orders
-        JOIN products ON orders.product_id = products.id
-        JOIN users ON orders.user_id = users.id
-        WHERE orders.id=? AND orders.user_id=?
-    """, (order_id, session["user_id"])).fetchone()
-    
-    if not order:
-        flash("Order not found", "danger")
-        conn.close()
-        return redirect("/orders")
+INVOICE_QUERY = """
+    SELECT orders.*, users.name as user_name, users.email
+    FROM orders
+    JOIN users ON orders.user_id = users.id
+"""
+
+def render_invoice(order):
+    """Draw the invoice for an order (from with_lines()) and return the PDF bytes"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.pdfgen import canvas
     
-    # Create PDF
     buffer = io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=letter)
     
@@ -818,27 +2730,91 @@ def download_invoice(order_id):
     p.drawString(1*inch, 8.5*inch, f"Name: {order['user_name']}")
     p.drawString(1*inch, 8.3*inch, f"Email: {order['email']}")
     
-    # Order details
+    # Order details, one line per product
     p.setFont("Helvetica-Bold", 14)
     p.drawString(1*inch, 7.8*inch, "Order Details:")
     p.setFont("Helvetica", 12)
-    p.drawString(1*inch, 7.5*inch, f"Product: {order['product_name']}")
-    p.drawString(1*inch, 7.3*inch, f"Quantity: {order['quantity']}")
-    p.drawString(1*inch, 7.1*inch, f"Status: {order['status'].upper()}")
+    p.drawString(1*inch, 7.5*inch, f"Status: {order['status'].upper()}")
+    
+    y = 7.2*inch
+    for item in order["items"]:
+        if y < 1.5*inch:
+            p.showPage()
+            p.setFont("Helvetica", 12)
+            y = 10*inch
+        p.drawString(1*inch, y, item["name"])
+        p.drawString(5*inch, y, f"x {item['quantity']}")
+        p.drawRightString(7.5*inch, y, f"₹{item['total_price']:.2f}")
+        y -= 0.25*inch
     
     # Total
     p.setFont("Helvetica-Bold", 16)
-    p.drawString(1*inch, 6.6*inch, f"Total: ₹{order['total_price']:.2f}")
+    p.drawString(1*inch, y - 0.25*inch, f"Total: ₹{order['total_price']:.2f}")
     
     p.showPage()
     p.save()
+    return buffer.getvalue()
+
+def cache_invoice(order):
+    """Path of the cached PDF for this order version, rendering it on a miss.
+
+    Also runs in the bulk export's worker processes, so it only touches files.
+    """
+    path = os.path.abspath(os.path.join(INVOICE_CACHE_FOLDER, f"invoice_{order['id']}_v{order['version']}.pdf"))
+    if os.path.exists(path):
+        return path
+    
+    # Unique per process and thread, two requests may render the same invoice at once
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(render_invoice(order))
+    os.replace(tmp, path)
+    
+    # Earlier versions of this invoice are stale now
+    for old in glob.glob(os.path.join(os.path.dirname(path), f"invoice_{order['id']}_v*.pdf")):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path
+
+def invoice_pdf(order):
+    """PDF bytes for this order version, read from the invoice cache.
+
+    A status change can replace the cached file between cache_invoice()
+    and the read; the invoice is then rendered again rather than lost.
+    """
+    try:
+        with open(cache_invoice(order), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return render_invoice(order)
+
+@app.route("/download_invoice/<int:order_id>")
+@login_required
+def download_invoice(order_id):
+    conn = db()
+    order = conn.execute(INVOICE_QUERY + " WHERE orders.id=? AND orders.user_id=?",
+                         (order_id, session["user_id"])).fetchone()
+    
+    if not order:
+        flash("Order not found", "danger")
+        conn.close()
+        return redirect("/orders")
     
-    buffer.seek(0)
+    order = with_lines(conn, [order])[0]
     conn.close()
     
-    return send_file(buffer, as_attachment=True, 
-                    download_name=f"invoice_{order_id}.pdf",
-                    mimetype='application/pdf')
+    # The invoice only changes with the order version, so revalidate by ETag
+    etag = f"invoice-{order['id']}-{order['version']}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = send_file(io.BytesIO(invoice_pdf(order)), as_attachment=True,
+                             download_name=f"invoice_{order_id}.pdf",
+                             mimetype='application/pdf')
+    return revalidate(response, etag)
 
 # ================= USER PROFILE =================
 @app.route("/user/profile", methods=["GET","POST"])
@@ -859,18 +2835,18 @@ def user_profile():
         
         if img and img.filename:
             if allowed_file(img.filename):
-                filename = secure_filename(img.filename)
-                # Add timestamp to filename to avoid conflicts
-                filename = f"{int(datetime.now().timestamp())}_{filename}"
-                img.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+                filename, _ = store_upload(img)
             else:
                 flash("Invalid file type. Allowed: png, jpg, jpeg, gif, webp", "danger")
                 conn.close()
                 return redirect("/user/profile")
 
+        # Upsert rather than REPLACE, which would skip the upload_refs triggers
         conn.execute("""
-            INSERT OR REPLACE INTO user_profile(user_id, name, dob, gender, image, phone, address) 
+            INSERT INTO user_profile(user_id, name, dob, gender, image, phone, address) 
             VALUES(?,?,?,?,?,?,?)
+            ON CONFLICT(user_id) DO UPDATE SET name=excluded.name, dob=excluded.dob, gender=excluded.gender,
+                image=excluded.image, phone=excluded.phone, address=excluded.address
         """, (uid, name, dob, gender, filename, phone, address))
         conn.commit()
         flash("Profile updated successfully", "success")
@@ -901,14 +2877,15 @@ def user_change_password():
             flash("New passwords do not match", "danger")
             return render_template("user_change_password.html")
         
+        limit_attempts(f"user-id:{session['user_id']}")
         conn = db()
         user = conn.execute("SELECT password FROM users WHERE id=?", 
                           (session["user_id"],)).fetchone()
         
-        if not check_password_hash(user["password"], old):
+        if not verify_password(user["password"], old):
             flash("Current password is incorrect", "danger")
         else:
-            hashed = generate_password_hash(new)
+            hashed = hash_password(new)
             conn.execute("UPDATE users SET password=? WHERE id=?", 
                         (hashed, session["user_id"]))
             conn.commit()
@@ -924,22 +2901,23 @@ def user_change_password():
 def admin_dashboard():
     conn = db()
     
-    # Get statistics
+    # Get statistics; order figures come from the sales rollups and exclude cancelled orders
     total_products = conn.execute("SELECT COUNT(*) as count FROM products").fetchone()["count"]
-    total_orders = conn.execute("SELECT COUNT(*) as count FROM orders").fetchone()["count"]
     total_users = conn.execute("SELECT COUNT(*) as count FROM users").fetchone()["count"]
-    total_revenue = conn.execute("SELECT SUM(total_price) as total FROM orders").fetchone()["total"] or 0
+    totals = conn.execute("SELECT SUM(orders) as orders, SUM(revenue) as revenue FROM sales_daily").fetchone()
+    total_orders = totals["orders"] or 0
+    total_revenue = totals["revenue"] or 0
     
     # Recent orders
     recent_orders = conn.execute("""
-        SELECT orders.id, users.name as user_name, products.name as product_name, 
-               orders.quantity, orders.total_price, orders.status, orders.order_date
+        SELECT orders.id, users.name as user_name, 
+               orders.total_price, orders.status, orders.order_date
         FROM orders
         JOIN users ON orders.user_id = users.id
-        JOIN products ON orders.product_id = products.id
         ORDER BY orders.order_date DESC
         LIMIT 10
     """).fetchall()
+    recent_items = order_lines(conn, [order["id"] for order in recent_orders])
     
     # Low stock products
     low_stock = conn.execute("""
@@ -948,19 +2926,18 @@ def admin_dashboard():
     
     # Sales data for chart (last 7 days)
     sales_data = conn.execute("""
-        SELECT DATE(order_date) as date, SUM(total_price) as revenue, COUNT(*) as orders
-        FROM orders
-        WHERE order_date >= date('now', '-7 days')
-        GROUP BY DATE(order_date)
-        ORDER BY date
+        SELECT day as date, revenue, orders
+        FROM sales_daily
+        WHERE day >= date('now', '-7 days')
+        ORDER BY day
     """).fetchall()
     
     # Category-wise sales
     category_sales = conn.execute("""
-        SELECT products.category, SUM(orders.total_price) as revenue
-        FROM orders
-        JOIN products ON orders.product_id = products.id
-        GROUP BY products.category
+        SELECT category, SUM(revenue) as revenue
+        FROM sales_daily_category
+        GROUP BY category
+        HAVING SUM(revenue) > 0
         ORDER BY revenue DESC
     """).fetchall()
     
@@ -972,10 +2949,21 @@ def admin_dashboard():
                          total_users=total_users,
                          total_revenue=total_revenue,
                          recent_orders=recent_orders,
+                         recent_items=recent_items,
                          low_stock=low_stock,
                          sales_data=sales_data,
                          category_sales=category_sales)
 
+@app.route("/admin/cache_stats")
+@admin_required
+def admin_cache_stats():
+    return jsonify(catalog=catalog_cache.stats(), cards=card_cache.stats())
+
+@app.route("/admin/metrics")
+@admin_required
+def admin_metrics():
+    return Response(request_metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
 # ================= ADMIN PRODUCTS =================
 @app.route("/admin/products")
 @admin_required
@@ -985,18 +2973,24 @@ def admin_products():
     search = request.args.get("search", "")
     category = request.args.get("category", "")
     
-    query = "SELECT * FROM products WHERE 1=1"
+    query = "SELECT products.* FROM products"
     params = []
     
-    if search:
-        query += " AND name LIKE ?"
-        params.append(f"%{search}%")
+    match = fts_query(search)
+    if match:
+        query += " JOIN products_fts ON products_fts.rowid = products.id WHERE products_fts MATCH ?"
+        params.append(match)
+    else:
+        query += " WHERE 1=1"
     
     if category:
-        query += " AND category=?"
+        query += " AND products.category=?"
         params.append(category)
     
-    query += " ORDER BY created_at DESC"
+    if match:
+        query += f" ORDER BY {SEARCH_RANK}"
+    else:
+        query += " ORDER BY products.created_at DESC"
     
     products = conn.execute(query, params).fetchall()
     categories = conn.execute("SELECT DISTINCT category FROM products").fetchall()
@@ -1033,10 +3027,8 @@ def admin_add_product():
         
         if img and img.filename:
             if allowed_file(img.filename):
-                filename = secure_filename(img.filename)
-                filename = f"{int(datetime.now().timestamp())}_{filename}"
-                img.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-            else:
+                filename = save_product_image(img)
+            if not filename:
                 flash("Invalid file type", "danger")
                 return render_template("admin_add_product.html")
         
@@ -1089,11 +3081,8 @@ def admin_edit_product(pid):
         
         if request.files.get("image") and request.files["image"].filename:
             img = request.files["image"]
-            if allowed_file(img.filename):
-                filename = secure_filename(img.filename)
-                filename = f"{int(datetime.now().timestamp())}_{filename}"
-                img.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-            else:
+            filename = save_product_image(img) if allowed_file(img.filename) else None
+            if not filename:
                 flash("Invalid file type", "danger")
                 return render_template("admin_edit_product.html", product=product)
 
@@ -1115,8 +3104,19 @@ def admin_edit_product(pid):
 @admin_required
 def delete_product(pid):
     conn = db()
-    conn.execute("DELETE FROM products WHERE id=?", (pid,))
-    conn.commit()
+    
+    # Carts, wishlists and reviews go with the product; orders keep it alive
+    try:
+        conn.execute("DELETE FROM cart WHERE product_id=?", (pid,))
+        conn.execute("DELETE FROM wishlist WHERE product_id=?", (pid,))
+        conn.execute("DELETE FROM reviews WHERE product_id=?", (pid,))
+        conn.execute("DELETE FROM products WHERE id=?", (pid,))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        flash("Product has orders and cannot be deleted. Set its stock to 0 instead.", "danger")
+        return redirect("/admin/products")
+    
     conn.close()
     
     flash("Product deleted successfully", "success")
@@ -1129,41 +3129,64 @@ def admin_orders():
     conn = db()
     
     status_filter = request.args.get("status", "")
+    where, params = order_filters(request.args)
+    total = order_count(conn, where, params)
     
-    query = """
+    query = f"""
         SELECT orders.id, users.name as user_name, users.email, 
-               products.name as product_name, orders.quantity, 
                orders.total_price, orders.status, orders.order_date
         FROM orders
         JOIN users ON orders.user_id = users.id
-        JOIN products ON orders.product_id = products.id
-        WHERE 1=1
+        WHERE {where}
     """
-    params = []
     
-    if status_filter:
-        query += " AND orders.status=?"
-        params.append(status_filter)
+    # Keyset pagination on (order_date, id), newest first
+    cursor = decode_cursor(request.args.get("cursor", ""))
+    if cursor and len(cursor) == 2:
+        query += " AND (orders.order_date, orders.id) < (?, ?)"
+        params.extend(cursor)
     
-    query += " ORDER BY orders.order_date DESC"
+    query += " ORDER BY orders.order_date DESC, orders.id DESC LIMIT ?"
+    params.append(ADMIN_ORDERS_PAGE_SIZE + 1)
     
     orders = conn.execute(query, params).fetchall()
+    
+    next_cursor = None
+    if len(orders) > ADMIN_ORDERS_PAGE_SIZE:
+        orders = orders[:ADMIN_ORDERS_PAGE_SIZE]
+        next_cursor = encode_cursor(orders[-1]["order_date"], orders[-1]["id"])
+    
+    items = order_lines(conn, [order["id"] for order in orders])
     conn.close()
+    first_url, next_url = page_links("admin_orders", next_cursor)
+    
+    # Export whatever the current filters select
+    export_args = request.args.to_dict()
+    export_args.pop("cursor", None)
+    export_url = url_for("export_orders", **export_args)
+    invoices_url = url_for("bulk_invoices", **export_args)
     
-    return render_template("admin_orders.html", orders=orders, status_filter=status_filter)
+    return render_template("admin_orders.html", orders=orders, items=items, status_filter=status_filter,
+                         total=total, first_url=first_url, next_url=next_url,
+                         export_url=export_url, invoices_url=invoices_url)
 
 @app.route("/admin/update_order_status/<int:order_id>", methods=["POST"])
 @admin_required
 def update_order_status(order_id):
     status = request.form.get("status")
     
-    if status not in ["pending", "confirmed", "shipped", "delivered", "cancelled"]:
+    if status not in ORDER_STATUSES:
         flash("Invalid status", "danger")
-        return redirect("/admin/orders")
+        return redirect(request.referrer or "/admin/orders")
     
     conn = db()
-    conn.execute("UPDATE orders SET status=? WHERE id=?", (status, order_id))
-    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    old = conn.execute("SELECT status FROM orders WHERE id=?", (order_id,)).fetchone()
+    conn.execute("UPDATE orders SET status=?, version=version+1 WHERE id=?", (status, order_id))
+    
+    # Cancelled orders stay out of the sales rollups
+    if old and (old["status"] == "cancelled") != (status == "cancelled"):
+        record_sales(conn, order_id, -1 if status == "cancelled" else 1)
     
     # Get user email for notification
     order = conn.execute("""
@@ -1173,60 +3196,164 @@ def update_order_status(order_id):
         WHERE orders.id=?
     """, (order_id,)).fetchone()
     
-    # Send email notification
-    try:
-        msg = Message("Order Status Update", recipients=[order["email"]])
-        msg.body = f"""
+    # Queue email notification in the same transaction
+    if order:
+        queue_email(conn, order["email"], "Order Status Update", f"""
 Hello {order["name"]},
 
 Your order #{order['id']} status has been updated to: {status.upper()}
 
 Thank you for shopping with us!
-        """
-        mail.send(msg)
-    except:
-        pass
-    
+        """)
+    conn.commit()
     conn.close()
     flash("Order status updated", "success")
-    return redirect("/admin/orders")
+    return redirect(request.referrer or "/admin/orders")
 
-@app.route("/admin/export_orders")
-@admin_required
-def export_orders():
-    conn = db()
-    orders = conn.execute("""
-        SELECT orders.id, users.name as user_name, users.email,
-               products.name as product_name, orders.quantity,
-               orders.total_price, orders.status, orders.order_date
-        FROM orders
-        JOIN users ON orders.user_id = users.id
-        JOIN products ON orders.product_id = products.id
-        ORDER BY orders.order_date DESC
-    """).fetchall()
-    conn.close()
+def stream_orders_csv(where, params, compress=False):
+    """Yield the order export as CSV chunks, one fetchmany() batch at a time"""
+    import csv
     
-    # Create CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
     
-    # Header
+    def flush():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+    
+    # Header goes out before the query runs so the download starts at once
     writer.writerow(['Order ID', 'Customer Name', 'Email', 'Product', 
                     'Quantity', 'Total Price', 'Status', 'Order Date'])
+    yield flush()
     
-    # Data
-    for order in orders:
-        writer.writerow([order['id'], order['user_name'], order['email'],
-                        order['product_name'], order['quantity'], 
-                        order['total_price'], order['status'], order['order_date']])
+    # The stream outlives the request, so it holds its own connection
+    conn = _checkout()
+    try:
+        cursor = conn.execute(f"""
+            SELECT orders.id, users.name as user_name, users.email,
+                   orders.status, orders.order_date
+            FROM orders
+            JOIN users ON orders.user_id = users.id
+            WHERE {where}
+            ORDER BY orders.order_date DESC, orders.id DESC
+        """, params)
+        
+        # One CSV row per line item
+        while True:
+            orders = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not orders:
+                break
+            lines = order_lines(conn, [order["id"] for order in orders])
+            for order in orders:
+                writer.writerows(
+                    [order['id'], order['user_name'], order['email'], line['name'],
+                     line['quantity'], line['total_price'], order['status'], order['order_date']]
+                    for line in lines[order['id']]
+                )
+            chunk = flush()
+            if chunk:
+                yield chunk
+    finally:
+        _release(conn)
+    
+    if compressor:
+        yield compressor.flush()
+
+class _ZipStream(io.RawIOBase):
+    """Write-only sink that lets zipfile build an archive we can stream out in pieces"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def render_invoices(orders):
+    """Yield (order, pdf bytes) in order, rendering cache misses in a process pool"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    # Never fork: this runs on a request thread, and a forked child would
+    # inherit locks held by other threads and the pooled SQLite handles
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with ProcessPoolExecutor(max_workers=INVOICE_WORKERS, mp_context=context) as pool:
+        window = deque()
+        for order in orders:
+            window.append((order, pool.submit(invoice_pdf, order)))
+            # Keep every worker busy without queueing the whole range in memory
+            if len(window) >= INVOICE_WORKERS * 4:
+                order, future = window.popleft()
+                yield order, future.result()
+        while window:
+            order, future = window.popleft()
+            yield order, future.result()
+
+def stream_invoices_zip(where, params):
+    """Yield a ZIP of the invoices for the matching orders as it is built"""
+    conn = _checkout()
+    try:
+        cursor = conn.execute(INVOICE_QUERY + f" WHERE {where} ORDER BY orders.order_date, orders.id", params)
+        
+        def orders():
+            while True:
+                rows = cursor.fetchmany(INVOICE_WORKERS * 4)
+                if not rows:
+                    break
+                yield from with_lines(conn, rows)
+        
+        out = _ZipStream()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+            for order, pdf in render_invoices(orders()):
+                archive.writestr(f"invoice_{order['id']}.pdf", pdf)
+                yield out.drain()
+        yield out.drain()
+    finally:
+        _release(conn)
+
+@app.route("/admin/invoices")
+@admin_required
+def bulk_invoices():
+    date_from = parse_date(request.args.get("date_from", ""))
+    date_to = parse_date(request.args.get("date_to", ""))
+    
+    if not date_from or not date_to:
+        flash("Choose a date range to download invoices", "warning")
+        return redirect(request.referrer or "/admin/orders")
+    
+    where, params = order_filters(request.args)
+    return Response(
+        stream_invoices_zip(where, params),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=invoices_{date_from}_{date_to}.zip'}
+    )
+
+@app.route("/admin/export_orders")
+@admin_required
+def export_orders():
+    where, params = order_filters(request.args)
+    compress = request.args.get("gzip") == "1"
     
-    output.seek(0)
+    filename = f'orders_{datetime.now().strftime("%Y%m%d")}.csv'
+    if compress:
+        filename += '.gz'
     
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'orders_{datetime.now().strftime("%Y%m%d")}.csv'
+    return Response(
+        stream_orders_csv(where, params, compress),
+        mimetype='application/gzip' if compress else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 # ================= ADMIN PROFILE =================
@@ -1245,18 +3372,18 @@ def admin_profile():
         
         if img and img.filename:
             if allowed_file(img.filename):
-                filename = secure_filename(img.filename)
-                filename = f"{int(datetime.now().timestamp())}_{filename}"
-                img.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+                filename, _ = store_upload(img)
             else:
                 flash("Invalid file type", "danger")
                 conn.close()
                 return redirect("/admin/profile")
 
-        conn.execute(
-            "INSERT OR REPLACE INTO admin_profile VALUES(1,?,?,?,?)",
-            (name, dob, gender, filename)
-        )
+        # Upsert rather than REPLACE, which would skip the upload_refs triggers
+        conn.execute("""
+            INSERT INTO admin_profile(admin_id, name, dob, gender, image) VALUES(1,?,?,?,?)
+            ON CONFLICT(admin_id) DO UPDATE SET name=excluded.name, dob=excluded.dob,
+                gender=excluded.gender, image=excluded.image
+        """, (name, dob, gender, filename))
         conn.commit()
         flash("Profile updated successfully", "success")
 
@@ -1286,13 +3413,14 @@ def admin_change_password():
             flash("New passwords do not match", "danger")
             return render_template("admin_change_password.html")
 
+        limit_attempts("admin-id:1")
         conn = db()
         admin = conn.execute("SELECT password FROM admin WHERE id=1").fetchone()
 
-        if not check_password_hash(admin["password"], old):
+        if not verify_password(admin["password"], old):
             flash("Current password is incorrect", "danger")
         else:
-            hashed = generate_password_hash(new)
+            hashed = hash_password(new)
             conn.execute("UPDATE admin SET password=? WHERE id=1", (hashed,))
             conn.commit()
             flash("Password changed successfully", "success")
@@ -1313,10 +3441,36 @@ def logout():
 def not_found(e):
     return render_template("404.html"), 404
 
+@app.errorhandler(429)
+def too_many_requests(e):
+    response = make_response(render_template("429.html", message=e.description), 429)
+    if e.retry_after:
+        response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
 @app.errorhandler(500)
 def server_error(e):
     return render_template("500.html"), 500
 
 # ================= RUN =================
+def create_app(config=None):
+    """The app configured for serving, as used by wsgi.py.
+
+    Settings are read from the environment at import; config overrides
+    them. Routes are registered on the module-level app, so every call
+    configures and returns that same app. Raises RuntimeError if the
+    database needs `flask init-db` first.
+    """
+    if config:
+        app.config.update(config)
+    check_schema()
+    
+    proxies = app.config["TRUSTED_PROXIES"]
+    if proxies and not isinstance(app.wsgi_app, ProxyFix):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+    return app
+
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server only; serve production through wsgi.py
+    init_db()
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""Cost of deep catalog pages: keyset cursor against LIMIT/OFFSET.
+
+Fills a fresh database with generated products, walks the /products query
+for page 1 and page N with both strategies, and times each.
+
+    python benchmarks/bench_catalog_pages.py [products] [page]
+"""
+import sys
+
+from bench_product_search import fill
+from common import load_app, measure, report, summarize
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    page = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    agro = load_app(copy_db=False)
+    conn = agro.db()
+    fill(conn, count)
+
+    size = agro.CATALOG_PAGE_SIZE
+    base = "SELECT products.*, products.price AS sort_value FROM products WHERE 1=1"
+    offset_sql = base + " ORDER BY products.price ASC, products.id ASC LIMIT ? OFFSET ?"
+    keyset_sql = (base + " AND (products.price, products.id) > (?, ?)"
+                  " ORDER BY products.price ASC, products.id ASC LIMIT ?")
+
+    # Position of the last row before the requested page, as a cursor holds it
+    last = conn.execute(offset_sql, (1, (page - 1) * size - 1)).fetchone()
+
+    print(f"{count} products, page size {size}, sort price_low")
+    for label, sql, params in [
+        ("OFFSET page 1", offset_sql, (size, 0)),
+        (f"OFFSET page {page}", offset_sql, (size, (page - 1) * size)),
+        ("keyset page 1", base + " ORDER BY products.price ASC, products.id ASC LIMIT ?", (size,)),
+        (f"keyset page {page}", keyset_sql, (last["sort_value"], last["id"], size)),
+    ]:
+        report(label, summarize(measure(lambda: conn.execute(sql, params).fetchall(), 200)))
+
+
+if __name__ == "__main__":
+    main()
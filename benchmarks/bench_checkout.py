@@ -0,0 +1,123 @@
+"""Concurrent checkout stress test: oversell and throughput.
+
+Seeds one hot product with limited stock and many customers who each have
+it in their cart, then lets worker threads check them all out at once, each
+thread on its own connection like a separate request. The legacy variant
+reproduces the old payment(): read stock, compare in Python, then write with
+an unconditional decrement outside an immediate transaction.
+
+Oversell is units sold beyond the starting stock; it must be 0 for
+place_order().
+
+    python benchmarks/bench_checkout.py [customers] [threads] [stock]
+"""
+import queue
+import sys
+import threading
+import time
+
+from common import load_app
+
+
+def seed(conn, customers, stock):
+    conn.execute("INSERT INTO products(name, category, price, stock) VALUES('Hot Seed', 'Seeds', 25, ?)", (stock,))
+    product_id = conn.execute("SELECT MAX(id) FROM products").fetchone()[0]
+    conn.executemany("INSERT INTO users(name, email, password) VALUES(?,?,'x')",
+                     ((f"Buyer {i}", f"buyer{i}@example.com") for i in range(customers)))
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE email LIKE 'buyer%@example.com'")]
+    conn.commit()
+    return product_id, user_ids
+
+
+def fill_carts(conn, product_id, user_ids, stock):
+    conn.execute("UPDATE products SET stock=? WHERE id=?", (stock, product_id))
+    conn.execute("DELETE FROM cart WHERE product_id=?", (product_id,))
+    conn.executemany("INSERT INTO cart(user_id, product_id, quantity) VALUES(?,?,?)",
+                     ((user_id, product_id, 1 + user_id % 3) for user_id in user_ids))
+    conn.commit()
+
+
+def legacy_checkout(conn, user_id, payment_method):
+    """The old payment() body: check in Python, then decrement unconditionally."""
+    items = conn.execute("""
+        SELECT cart.product_id, cart.quantity, products.price, products.stock
+        FROM cart JOIN products ON cart.product_id=products.id
+        WHERE cart.user_id=?
+    """, (user_id,)).fetchall()
+    for item in items:
+        if item["quantity"] > item["stock"]:
+            return None
+    for item in items:
+        conn.execute("INSERT INTO orders(user_id, product_id, quantity, total_price, status) VALUES(?,?,?,?,?)",
+                     (user_id, item["product_id"], item["quantity"], item["quantity"] * item["price"], "confirmed"))
+        conn.execute("UPDATE products SET stock = stock - ? WHERE id=?", (item["quantity"], item["product_id"]))
+    conn.execute("DELETE FROM cart WHERE user_id=?", (user_id,))
+    conn.commit()
+    return True
+
+
+def run(agro, label, checkout, product_id, user_ids, threads, stock):
+    setup = agro._connect()
+    fill_carts(setup, product_id, user_ids, stock)
+
+    pending = queue.Queue()
+    for user_id in user_ids:
+        pending.put(user_id)
+    results = {"ok": 0, "rejected": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def worker():
+        conn = agro._connect()
+        while True:
+            try:
+                user_id = pending.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                outcome = "ok" if checkout(conn, user_id, "cod") else "rejected"
+            except agro.CheckoutError:
+                outcome = "rejected"
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                outcome = "errors"
+            with lock:
+                results[outcome] += 1
+        conn.dispose()
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    left = setup.execute("SELECT stock FROM products WHERE id=?", (product_id,)).fetchone()[0]
+    oversell = max(0, -left)
+    setup.dispose()
+
+    print(f"{label:<16} {results['ok']:>5} placed  {results['rejected']:>5} out of stock  "
+          f"{results['errors']:>3} errors  stock left {left:>5}  oversell {oversell:>4}  "
+          f"{(results['ok'] + results['rejected']) / elapsed:>8.0f} checkouts/s")
+    return oversell
+
+
+def main():
+    customers = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    stock = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    agro = load_app()
+    conn = agro._connect()
+    product_id, user_ids = seed(conn, customers, stock)
+    conn.dispose()
+
+    print(f"{customers} customers, {threads} threads, {stock} units in stock")
+    run(agro, "legacy", legacy_checkout, product_id, user_ids, threads, stock)
+    oversell = run(agro, "place_order()", agro.place_order, product_id, user_ids, threads, stock)
+    if oversell:
+        sys.exit("place_order() oversold")
+
+
+if __name__ == "__main__":
+    main()
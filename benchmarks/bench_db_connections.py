@@ -0,0 +1,48 @@
+"""Per-request cost of the pooled db() against a fresh connection per call.
+
+The legacy path mirrors the original db(): sqlite3.connect() in the default
+rollback-journal mode, a couple of queries, then close(). The pooled path
+runs the same queries inside an app context so teardown_appcontext returns
+the connection to the pool.
+
+    python benchmarks/bench_db_connections.py [iterations]
+"""
+import sqlite3
+import sys
+
+from common import load_app, measure, report, summarize
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    agro = load_app()
+
+    def queries(conn):
+        conn.execute("SELECT * FROM products ORDER BY id LIMIT 1").fetchone()
+        conn.execute("SELECT COUNT(*) FROM cart WHERE user_id=?", (1,)).fetchone()
+
+    def legacy_request():
+        with agro.app.app_context():
+            conn = sqlite3.connect(agro.DB)
+            conn.row_factory = sqlite3.Row
+            queries(conn)
+            conn.close()
+
+    def pooled_request():
+        with agro.app.app_context():
+            conn = agro.db()
+            queries(conn)
+            conn.close()
+
+    legacy = summarize(measure(legacy_request, iterations))
+    pooled = summarize(measure(pooled_request, iterations))
+
+    print(f"{iterations} simulated requests, 2 queries each")
+    report("legacy connect-per-call", legacy)
+    report("pooled db()", pooled)
+    print(f"saving per request: {legacy['mean_us'] - pooled['mean_us']:.1f}us "
+          f"({legacy['mean_us'] / pooled['mean_us']:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
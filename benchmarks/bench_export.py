@@ -0,0 +1,88 @@
+"""Memory and time-to-first-byte of /admin/export_orders.
+
+Seeds a fresh database with N orders, then downloads the export through the
+test client. The legacy variant reproduces the old fetchall() + StringIO +
+BytesIO implementation for comparison. Peak memory is measured with
+tracemalloc, so absolute times include its overhead.
+
+    python benchmarks/bench_export.py [orders]
+"""
+import csv
+import io
+import sys
+import time
+import tracemalloc
+
+from common import load_app
+
+
+def seed(conn, count):
+    conn.execute("INSERT INTO users(name, email, password) VALUES('Bench', 'bench@example.com', 'x')")
+    conn.execute("INSERT INTO products(name, category, price, stock) VALUES('Bench Seed', 'Seeds', 10, 0)")
+    user_id, product_id = 1, conn.execute("SELECT MAX(id) FROM products").fetchone()[0]
+    rows = ((user_id, product_id, 1 + i % 5, 10.0 * (1 + i % 5),
+             ("confirmed", "shipped", "delivered")[i % 3],
+             f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:00:00")
+            for i in range(count))
+    conn.executemany(
+        "INSERT INTO orders(user_id, product_id, quantity, total_price, status, order_date) "
+        "VALUES(?,?,?,?,?,?)", rows)
+    conn.commit()
+
+
+def legacy_export(agro):
+    """The export as it was: the whole result set in memory three times."""
+    conn = agro.db()
+    orders = conn.execute("""
+        SELECT orders.id, users.name as user_name, users.email,
+               products.name as product_name, orders.quantity,
+               orders.total_price, orders.status, orders.order_date
+        FROM orders
+        JOIN users ON orders.user_id = users.id
+        JOIN products ON orders.product_id = products.id
+        ORDER BY orders.order_date DESC
+    """).fetchall()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Order ID', 'Customer Name', 'Email', 'Product',
+                     'Quantity', 'Total Price', 'Status', 'Order Date'])
+    for order in orders:
+        writer.writerow(list(order))
+    yield io.BytesIO(output.getvalue().encode('utf-8')).getvalue()
+
+
+def run(label, chunks):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in chunks:
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<14} {size / 1e6:>8.1f}MB out  first byte {first * 1000:>9.1f}ms  "
+          f"total {total:>6.1f}s  peak memory {peak / 1e6:>8.1f}MB")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    agro = load_app(copy_db=False)
+    with agro.app.app_context():
+        seed(agro.db(), count)
+
+    client = agro.app.test_client()
+    with client.session_transaction() as session:
+        session["admin"] = True
+
+    print(f"{count} orders")
+    with agro.app.app_context():
+        run("legacy", legacy_export(agro))
+    run("streaming", client.get("/admin/export_orders", buffered=False).iter_encoded())
+    run("streaming gzip", client.get("/admin/export_orders?gzip=1", buffered=False).iter_encoded())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Page weight of a product grid with original uploads against generated variants.
+
+Writes N camera-sized JPEG uploads (noisy gradients, which compress about as
+badly as real photos), runs make_image_variants() on each, then compares the
+bytes a browser fetches for an N-card grid: the originals, as products.html
+used to serve them, against the card variant in JPEG and WebP.
+
+    python benchmarks/bench_image_variants.py [images] [width] [height]
+"""
+import os
+import sys
+import time
+
+from PIL import Image, ImageFilter
+
+from common import load_app
+
+
+def make_upload(path, width, height, seed):
+    noise = Image.effect_noise((width, height), 64 + seed % 32).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    image = Image.blend(noise, gradient, 0.5).filter(ImageFilter.GaussianBlur(1))
+    image.save(path, "JPEG", quality=95)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 2250
+    agro = load_app()
+
+    names = [f"bench_{i}.jpg" for i in range(count)]
+    for i, name in enumerate(names):
+        make_upload(os.path.join(agro.UPLOAD_FOLDER, name), width, height, i)
+
+    start = time.perf_counter()
+    for name in names:
+        agro.make_image_variants(name)
+    elapsed = time.perf_counter() - start
+
+    def total(paths):
+        return sum(os.path.getsize(path) for path in paths)
+
+    original = total(os.path.join(agro.UPLOAD_FOLDER, name) for name in names)
+    print(f"{count} uploads of {width}x{height}, variants built in "
+          f"{elapsed / count * 1000:.0f}ms per upload")
+    print(f"{'grid of originals':<24} {original / 1e6:>10.1f} MB")
+    for ext in ("jpg", "webp"):
+        size = total(os.path.join(agro.VARIANT_FOLDER, agro.variant_name(name, "card", ext)) for name in names)
+        print(f"{'grid of card ' + ext:<24} {size / 1e3:>10.1f} KB  ({original / size:.0f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Checkout latency while /login is flooded with credential-stuffing attempts.
+
+One customer checks out in a loop (add to cart, then POST /payment) while
+flood threads post wrong passwords for many existing accounts from many
+addresses, so that every attempt reaches password hashing. Three runs: no
+flood, a flood with hashing on the request threads and no rate limits (as
+before admission control), and a flood with the hashing pool and token
+buckets in place.
+
+    python benchmarks/bench_login_flood.py [flood threads] [seconds]
+"""
+import random
+import sys
+import threading
+import time
+
+from common import load_app, percentile
+
+PASSWORD = "bench-password"
+
+
+def seed(agro, accounts):
+    conn = agro._connect()
+    hashed = agro.generate_password_hash(PASSWORD, agro.PASSWORD_HASH_METHOD)
+    conn.executemany("INSERT OR IGNORE INTO users(name, email, password) VALUES(?,?,?)",
+                     ((f"Flood {i}", f"flood{i}@example.com", hashed) for i in range(accounts)))
+    conn.execute("INSERT INTO products(name, category, price, stock) VALUES('Bench Seed', 'Seeds', 10, 1000000)")
+    product_id = conn.execute("SELECT MAX(id) FROM products").fetchone()[0]
+    conn.commit()
+    conn.dispose()
+    return product_id
+
+
+def checkout_loop(agro, product_id, stop, samples):
+    client = agro.app.test_client()
+    client.post("/login", data={"role": "user", "email": "flood0@example.com", "password": PASSWORD},
+                environ_base={"REMOTE_ADDR": "192.0.2.1"})
+    with client.session_transaction() as session:
+        token = session.setdefault("csrf_token", "flood")
+    while not stop.is_set():
+        client.post(f"/add_to_cart/{product_id}", data={"csrf_token": token})
+        start = time.perf_counter()
+        response = client.post("/payment", data={"payment_method": "cod"})
+        samples.append(time.perf_counter() - start)
+        if response.status_code != 302:
+            raise RuntimeError(f"checkout returned {response.status_code}")
+
+
+def flood_loop(agro, accounts, stop, outcomes, lock):
+    client = agro.app.test_client()
+    rng = random.Random()
+    while not stop.is_set():
+        response = client.post("/login", data={"role": "user", "email": f"flood{rng.randrange(1, accounts)}@example.com",
+                                               "password": "wrong-password"},
+                               environ_base={"REMOTE_ADDR": f"10.{rng.randrange(256)}.{rng.randrange(256)}.1"})
+        with lock:
+            outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+
+
+def run(agro, label, product_id, flood_threads, accounts, seconds):
+    stop = threading.Event()
+    samples, outcomes, lock = [], {}, threading.Lock()
+    threads = [threading.Thread(target=checkout_loop, args=(agro, product_id, stop, samples))]
+    threads += [threading.Thread(target=flood_loop, args=(agro, accounts, stop, outcomes, lock))
+                for _ in range(flood_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    attempts = sum(outcomes.values())
+    print(f"{label:<28} checkouts {len(samples):>5}  p50 {percentile(samples, 50) * 1e3:7.1f}ms  "
+          f"p99 {percentile(samples, 99) * 1e3:7.1f}ms  logins {attempts / seconds:6.0f}/s  "
+          f"rejected 429 {outcomes.get(429, 0)}")
+
+
+def main():
+    flood_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    accounts = 5000
+    agro = load_app()
+    product_id = seed(agro, accounts)
+    print(f"{flood_threads} flood threads, {seconds:.0f}s per run, {agro.HASH_WORKERS} hashing workers, "
+          f"queue depth {agro.HASH_QUEUE_DEPTH}")
+
+    run(agro, "no flood", product_id, 0, accounts, seconds)
+
+    hashing, ip_attempts, account_attempts = agro._hashing, agro.ip_attempts, agro.account_attempts
+    agro._hashing = lambda fn, *args: fn(*args)
+    agro.ip_attempts = agro.account_attempts = agro.TokenBucket(rate=1e9, burst=1e9)
+    run(agro, "flood, unbounded hashing", product_id, flood_threads, accounts, seconds)
+
+    agro._hashing, agro.ip_attempts, agro.account_attempts = hashing, ip_attempts, account_attempts
+    run(agro, "flood, admission control", product_id, flood_threads, accounts, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Render time of a catalog page with and without the product card cache.
+
+Fills a fresh database with generated products, then renders products.html
+for one page of them inside a request, as /products does, three ways:
+every card rendered from _product_card.html (the page before the cache),
+with the card cache emptied before each render (the first view after every
+product changed) and with a warm cache.
+
+    python benchmarks/bench_product_cards.py [cards per page]
+"""
+import sys
+
+from bench_product_search import fill
+from common import load_app, measure, report, summarize
+
+
+def main():
+    per_page = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    agro = load_app(copy_db=False)
+    conn = agro.db()
+    fill(conn, per_page)
+    # Give every card an image so the <picture> macro is part of the work
+    conn.execute("UPDATE products SET image = 'bench-' || id || '.jpg'")
+    conn.commit()
+    products = conn.execute("SELECT products.*, products.created_at AS sort_value FROM products "
+                            "ORDER BY products.id LIMIT ?", (per_page,)).fetchall()
+    wishlist_ids = [product["id"] for product in products[::7]]
+    categories = conn.execute("SELECT DISTINCT category FROM products ORDER BY category").fetchall()
+    conn.close()
+
+    def render():
+        return agro.render_template("products.html", products=products, categories=categories,
+                                    wishlist_ids=wishlist_ids, search="", category="", min_price="",
+                                    max_price="", sort="newest", first_url=None, next_url="/products?cursor=x")
+
+    def uncached(product):
+        return agro.Markup(agro.app.jinja_env.get_template("_product_card.html").render(product=product))
+
+    def cold():
+        agro.card_cache.clear()
+        return render()
+
+    with agro.app.test_request_context("/products"):
+        agro.session.update(user_id=1, user_name="Bench", role="user")
+        agro.app.preprocess_request()
+        cached = agro.app.jinja_env.globals["product_card"]
+        agro.app.jinja_env.globals["product_card"] = uncached
+        baseline = render()
+        print(f"{per_page} cards per page, {len(wishlist_ids)} of them wishlisted")
+        report("every card rendered", summarize(measure(render, 200)))
+
+        agro.app.jinja_env.globals["product_card"] = cached
+        if render() != baseline:
+            raise RuntimeError("cached page differs from the uncached one")
+        report("card cache, cold", summarize(measure(cold, 200)))
+        report("card cache, warm", summarize(measure(render, 200)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""LIKE '%term%' against the products_fts index on a large synthetic catalog.
+
+Builds a fresh database with the app's migrations, fills it with generated
+products (200k by default) and times both search paths for a few terms.
+
+    python benchmarks/bench_product_search.py [products]
+"""
+import random
+import sys
+import time
+
+from common import load_app, measure, report, summarize
+
+WORDS = ("organic hybrid tomato wheat rice maize cotton seed fertilizer urea "
+         "potash compost neem pesticide sprayer drip pipe tractor harvester "
+         "sickle spade soil tester mulch film greenhouse net bio fungicide "
+         "onion chilli brinjal mustard groundnut soybean sugarcane banana").split()
+CATEGORIES = ["Seeds", "Fertilizer", "Pesticide", "Tools", "Irrigation", "Machinery"]
+TERMS = ["tomato", "neem pest", "drip", "harvest", "kamori"]
+
+
+def vocabulary(rng, size=20_000):
+    """Pseudo-words so descriptions have a realistic spread of rare terms."""
+    syllables = ["ka", "ri", "mo", "ta", "ne", "su", "la", "po", "vi", "de", "gu", "an"]
+    return ["".join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(size)]
+
+
+def fill(conn, count):
+    rng = random.Random(42)
+    filler = vocabulary(rng)
+    rows = (
+        (" ".join(rng.choices(WORDS, k=3)).title(), rng.choice(CATEGORIES),
+         round(rng.uniform(10, 5000), 2),
+         " ".join(rng.choices(filler, k=35) + rng.choices(WORDS, k=2)),
+         rng.randint(0, 500))
+        for _ in range(count)
+    )
+    conn.executemany(
+        "INSERT INTO products(name, category, price, description, stock) VALUES(?,?,?,?,?)",
+        rows
+    )
+    conn.commit()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    agro = load_app(copy_db=False)
+    conn = agro.db()
+
+    start = time.perf_counter()
+    fill(conn, count)
+    print(f"inserted {count} products (with FTS triggers) in {time.perf_counter() - start:.1f}s")
+
+    # Both exactly as /products ran them before and after the change
+    like_sql = ("SELECT * FROM products WHERE 1=1 AND (name LIKE ? OR description LIKE ?) "
+                "ORDER BY created_at DESC")
+    fts_sql = ("SELECT products.* FROM products "
+               "JOIN products_fts ON products_fts.rowid = products.id "
+               f"WHERE products_fts MATCH ? ORDER BY {agro.SEARCH_RANK}")
+
+    for term in TERMS:
+        like_rows = []
+        like = summarize(measure(
+            lambda: like_rows.append(len(conn.execute(
+                like_sql, (f"%{term}%", f"%{term}%")).fetchall())), 5, warmup=1))
+        match = agro.fts_query(term)
+        fts_rows = []
+        fts = summarize(measure(
+            lambda: fts_rows.append(len(conn.execute(fts_sql, (match,)).fetchall())), 20, warmup=2))
+        print(f"\nsearch {term!r}: LIKE {like_rows[-1]} rows, FTS {fts_rows[-1]} rows")
+        report("LIKE '%term%'", like)
+        report("FTS5 MATCH + bm25", fts)
+        print(f"speedup: {like['mean_us'] / fts['mean_us']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
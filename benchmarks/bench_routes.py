@@ -0,0 +1,213 @@
+"""Latency, queries per request and peak RSS for every page, written as JSON.
+
+Runs against a scratch copy of a database, by default the checked-in one;
+fill a bigger one with scripts/seed_data.py first for realistic numbers.
+Each route is requested through Flask's test client as a customer with the
+most orders (or as the admin), with --threads clients in parallel. Queries
+are counted with a trace callback on every pooled connection.
+
+    python scripts/seed_data.py --db /tmp/big.db --orders 1000000
+    python benchmarks/bench_routes.py --db /tmp/big.db --out results.json
+
+Compare runs by diffing the JSON files; each records the git commit and the
+row counts it ran against.
+"""
+import argparse
+import json
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from common import ROOT, load_app, percentile
+
+PASSWORD = "bench-password"
+CSRF_TOKEN = "bench-csrf"
+
+USER_ROUTES = [
+    ("catalog", "/products"),
+    ("catalog price sort", "/products?sort=price_low"),
+    ("catalog category", "/products?category=Seeds&sort=name"),
+    ("catalog search", "/products?search=tomato"),
+    ("product page", "/product/{pid}"),
+    ("wishlist", "/wishlist"),
+    ("cart", "/cart"),
+    ("payment page", "/payment"),
+    ("orders", "/orders"),
+    ("invoice", "/download_invoice/{oid}"),
+    ("profile", "/user/profile"),
+    ("add to cart", "POST /add_to_cart/{pid}"),
+]
+
+ADMIN_ROUTES = [
+    ("admin dashboard", "/admin/dashboard"),
+    ("admin products", "/admin/products"),
+    ("admin product search", "/admin/products?search=seed"),
+    ("admin orders", "/admin/orders"),
+    ("admin orders status", "/admin/orders?status=shipped"),
+    ("admin orders product", "/admin/orders?product=tomato"),
+    ("admin export 7 days", "/admin/export_orders?date_from={week_ago}&date_to={today}"),
+]
+
+
+def prepare(agro):
+    """Known passwords and the ids the routes need, in the scratch copy only."""
+    conn = agro._connect()
+    password = agro.generate_password_hash(PASSWORD)
+    conn.execute("INSERT OR IGNORE INTO admin(id, username, password) VALUES(1, 'admin', ?)", (password,))
+    conn.execute("UPDATE admin SET password=? WHERE username='admin'", (password,))
+
+    row = conn.execute("SELECT user_id, COUNT(*) FROM orders GROUP BY user_id ORDER BY 2 DESC LIMIT 1").fetchone()
+    if row:
+        user_id = row[0]
+    else:
+        user_id = conn.execute("INSERT INTO users(name, email, password) VALUES('Bench', 'bench@example.com', '')").lastrowid
+    conn.execute("UPDATE users SET password=? WHERE id=?", (password, user_id))
+    email = conn.execute("SELECT email FROM users WHERE id=?", (user_id,)).fetchone()[0]
+
+    pid = conn.execute("SELECT id FROM products ORDER BY rating_count DESC LIMIT 1").fetchone()[0]
+    oid = conn.execute("SELECT id FROM orders WHERE user_id=? ORDER BY id DESC LIMIT 1", (user_id,)).fetchone()
+    conn.commit()
+
+    today = datetime.now(timezone.utc).date()
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("users", "products", "orders", "order_items", "reviews", "wishlist", "cart")}
+    conn.dispose()
+    return email, counts, {"pid": pid, "oid": oid[0] if oid else 0,
+                           "today": today, "week_ago": today.fromordinal(today.toordinal() - 7)}
+
+
+def count_queries(agro):
+    """Per-thread count of top-level statements, fed by a trace callback on every new connection."""
+    counter = threading.local()
+    connect = agro._connect
+
+    def count(sql):
+        # Statements run by triggers and FTS5 internals are reported with a "-- " prefix
+        if not sql.startswith("--"):
+            counter.n = getattr(counter, "n", 0) + 1
+
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(count)
+        return conn
+
+    agro._connect = traced_connect
+    return counter
+
+
+def login(agro, role, email):
+    client = agro.app.test_client()
+    response = client.post("/login", data={"role": role, "email": email, "password": PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f"{role} login failed")
+    with client.session_transaction() as session:
+        session["csrf_token"] = CSRF_TOKEN
+    return client
+
+
+def run_route(agro, counter, clients, path, iterations, warmup):
+    samples, queries, statuses = [], [], {}
+    lock = threading.Lock()
+    # Routes that change state are listed as "POST /path" and post the form's CSRF token
+    method, _, url = path.rpartition(" ")
+
+    def worker(client, count):
+        for i in range(warmup + count):
+            counter.n = 0
+            start = time.perf_counter()
+            if method == "POST":
+                response = client.post(url, data={"csrf_token": CSRF_TOKEN})
+            else:
+                response = client.get(url)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            response.close()
+            if i < warmup:
+                continue
+            with lock:
+                samples.append(elapsed)
+                queries.append(counter.n)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    per_client = max(1, iterations // len(clients))
+    threads = [threading.Thread(target=worker, args=(client, per_client)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    return {
+        "n": len(samples),
+        "p50_ms": percentile(samples, 50) * 1e3,
+        "p95_ms": percentile(samples, 95) * 1e3,
+        "p99_ms": percentile(samples, 99) * 1e3,
+        "mean_ms": sum(samples) / len(samples) * 1e3,
+        "requests_per_s": len(samples) / wall,
+        "queries_per_request": sum(queries) / len(queries),
+        "statuses": {str(code): n for code, n in sorted(statuses.items())},
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", help="database to copy and run against (default: the checked-in database.db)")
+    parser.add_argument("--iterations", type=int, default=50, help="measured requests per route")
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured requests per client first")
+    parser.add_argument("--threads", type=int, default=1, help="clients requesting each route in parallel")
+    parser.add_argument("--only", help="run only routes whose name contains this")
+    parser.add_argument("--out", help="write the JSON report here as well as stdout")
+    args = parser.parse_args()
+
+    agro = load_app(source=args.db)
+    counter = count_queries(agro)
+    email, counts, ids = prepare(agro)
+
+    results = []
+    for role, login_as, routes in (("user", email, USER_ROUTES), ("admin", "admin", ADMIN_ROUTES)):
+        clients = [login(agro, role, login_as) for _ in range(args.threads)]
+        for name, path in routes:
+            if args.only and args.only not in name:
+                continue
+            path = path.format(**ids)
+            stats = run_route(agro, counter, clients, path, args.iterations, args.warmup)
+            results.append({"route": name, "path": path, **stats})
+            print(f"{name:<24} p50 {stats['p50_ms']:8.2f}ms  p95 {stats['p95_ms']:8.2f}ms  "
+                  f"p99 {stats['p99_ms']:8.2f}ms  {stats['queries_per_request']:5.1f} queries  "
+                  f"{stats['requests_per_s']:8.0f} req/s", file=sys.stderr)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "threads": args.threads,
+        "iterations": args.iterations,
+        "rows": counts,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "routes": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
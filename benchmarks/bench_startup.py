@@ -0,0 +1,65 @@
+"""Cold start: time from a fresh interpreter to the first rendered response.
+
+Each run starts a new Python process in a scratch directory holding a
+migrated copy of database.db. The process imports app.py, calls create_app()
+and serves GET /login through the test client, reporting how long each
+step took. The first run starts without a Jinja bytecode cache; the others
+find the one it left, as a restarted worker would.
+
+    python benchmarks/bench_startup.py [runs]
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, ROOT)
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+response = app.app.test_client().get("/login")
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+print(json.dumps({"import": imported - start, "create_app": created - imported,
+                  "first_request": served - created, "modules": len(sys.modules)}))
+"""
+
+
+def run_once(workdir):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD.replace("ROOT", repr(ROOT))],
+                            cwd=workdir, capture_output=True, text=True, check=True).stdout
+    return {**json.loads(output), "total": time.perf_counter() - start}
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    workdir = tempfile.mkdtemp(prefix="agro-bench-")
+    shutil.copy(os.path.join(ROOT, "database.db"), workdir)
+    subprocess.run([sys.executable, "-m", "flask", "--app", os.path.join(ROOT, "app.py"), "init-db"],
+                   cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+    shutil.rmtree(os.path.join(workdir, "jinja_cache"), ignore_errors=True)
+
+    cold = run_once(workdir)
+    warm = [run_once(workdir) for _ in range(runs)]
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'':<22} {'import':>10} {'create_app':>11} {'1st request':>12} {'process total':>14}  modules")
+    for label, result in [("no template cache", cold)] + [
+            (f"median of {runs} warm", {key: statistics.median(r[key] for r in warm) for key in cold})]:
+        print(f"{label:<22} {result['import'] * 1e3:>8.1f}ms {result['create_app'] * 1e3:>9.1f}ms "
+              f"{result['first_request'] * 1e3:>10.1f}ms {result['total'] * 1e3:>12.1f}ms  {result['modules']:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Throughput of the gunicorn setup in gunicorn.conf.py as workers are added.
+
+Starts gunicorn on wsgi:app with 1, 2, 4... worker processes against a
+scratch copy of a database, then has client processes request a page with
+keep-alive connections for a fixed time and reports requests per second
+and latency per worker count. Clients run on the same machine, so leave
+them a core or two: scaling stops at the cores left for the server.
+
+    python benchmarks/bench_workers.py --db /tmp/big.db --workers 1,2,4,8 --clients 16
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from werkzeug.security import generate_password_hash
+
+from common import ROOT, percentile
+
+PASSWORD = "bench-password"
+
+
+def prepare(source):
+    """Scratch directory holding a migrated copy of source with one known customer password."""
+    workdir = tempfile.mkdtemp(prefix="agro-bench-")
+    path = os.path.join(workdir, "database.db")
+    shutil.copy(source, path)
+    conn = sqlite3.connect(path)
+    email = conn.execute("SELECT email FROM users ORDER BY id LIMIT 1").fetchone()[0]
+    conn.execute("UPDATE users SET password=? WHERE email=?", (generate_password_hash(PASSWORD), email))
+    conn.commit()
+    conn.close()
+    subprocess.run([sys.executable, "-m", "flask", "--app", os.path.join(ROOT, "app.py"), "init-db"],
+                   cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+    return workdir, email
+
+
+def start_server(workdir, port, workers, threads):
+    env = {**os.environ, "WEB_CONCURRENCY": str(workers), "THREADS": str(threads),
+           "BIND": f"127.0.0.1:{port}", "SECRET_KEY": "bench"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+         "--pythonpath", ROOT, "--access-logfile", "/dev/null", "wsgi:app"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/login")
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def login(port, email):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    body = f"role=user&email={email}&password={PASSWORD}"
+    conn.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+    response = conn.getresponse()
+    response.read()
+    return response.getheader("Set-Cookie").split(";")[0]
+
+
+def client(port, path, cookie, deadline, results):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    samples, errors = [], 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        conn.request("GET", path, headers={"Cookie": cookie})
+        response = conn.getresponse()
+        response.read()
+        samples.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors += 1
+    results.put((samples, errors))
+
+
+def run(port, path, cookie, clients, duration):
+    results = multiprocessing.Queue()
+    deadline = time.monotonic() + duration
+    procs = [multiprocessing.Process(target=client, args=(port, path, cookie, deadline, results))
+             for _ in range(clients)]
+    for proc in procs:
+        proc.start()
+    samples, errors = [], 0
+    for _ in procs:
+        got, failed = results.get()
+        samples.extend(got)
+        errors += failed
+    for proc in procs:
+        proc.join()
+    return samples, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default=os.path.join(ROOT, "database.db"), help="database to copy and serve")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts to try")
+    parser.add_argument("--threads", type=int, default=4, help="threads per worker")
+    parser.add_argument("--clients", type=int, default=8, help="client processes")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per worker count")
+    parser.add_argument("--path", default="/products", help="page to request as a logged-in customer")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    workdir, email = prepare(args.db)
+    print(f"{os.cpu_count()} cores, {args.clients} clients, {args.threads} threads per worker, GET {args.path}")
+    baseline = None
+    for workers in map(int, args.workers.split(",")):
+        server = start_server(workdir, args.port, workers, args.threads)
+        try:
+            cookie = login(args.port, email)
+            run(args.port, args.path, cookie, args.clients, 1)  # warm up every worker
+            samples, errors = run(args.port, args.path, cookie, args.clients, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        rate = len(samples) / args.duration
+        baseline = baseline or rate
+        print(f"{workers:>3} workers  {rate:>8.0f} req/s  ({rate / baseline:4.1f}x)  "
+              f"p50 {percentile(samples, 50) * 1e3:7.2f}ms  p99 {percentile(samples, 99) * 1e3:7.2f}ms  "
+              f"{errors} errors")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Shared helpers for the benchmark scripts.
+
+Every benchmark runs against a scratch copy of database.db inside a temporary
+directory, so the checked-in database is never modified.
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(copy_db=True, source=None):
+    """Import app.py with a scratch working directory and return the module.
+
+    source is the database copied in, the checked-in database.db by default.
+    The schema is brought up to date as `flask init-db` would.
+    """
+    workdir = tempfile.mkdtemp(prefix="agro-bench-")
+    if copy_db:
+        shutil.copy(source or os.path.join(ROOT, "database.db"), os.path.join(workdir, "database.db"))
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as app_module
+    app_module.init_db()
+    return app_module
+
+
+def measure(fn, iterations, warmup=50):
+    """Call fn repeatedly and return the per-call durations in seconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Summarize durations (seconds) as microsecond statistics."""
+    return {
+        "n": len(samples),
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p95_us": percentile(samples, 95) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+    }
+
+
+def report(label, stats):
+    print(f"{label:<32} mean {stats['mean_us']:>10.1f}us  "
+          f"p50 {stats['p50_us']:>10.1f}us  p95 {stats['p95_us']:>10.1f}us  "
+          f"p99 {stats['p99_us']:>10.1f}us")
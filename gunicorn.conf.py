@@ -0,0 +1,29 @@
+"""gunicorn settings for wsgi:app; WEB_CONCURRENCY, THREADS and BIND override them.
+
+One worker process per core is what runs Python in parallel; the threads in
+each worker cover requests waiting on SQLite, disk or SMTP. SQLite takes one
+writer at a time across all workers, so more than about two workers per core
+only adds lock waits at checkout.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", 4))
+
+# Import app.py once in the master and fork the workers from it. The schema
+# check in create_app() closes its connection before that, and the
+# connection pool starts over in every forked worker.
+preload_app = True
+
+# Order exports and invoice zips stream for a while
+timeout = 120
+graceful_timeout = 30
+
+# Recycle workers now and then, staggered so they do not all restart at once
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = "-"
@@ -0,0 +1,179 @@
+"""Drive the email outbox against a local SMTP server and check what arrives.
+
+A stand-in server from aiosmtpd (pip install aiosmtpd) listens on a free
+local port and refuses any recipient starting with "reject" with a 550.
+The app runs against a scratch copy of database.db, with its mail settings
+pointed at that server, and drain_outbox() is checked for:
+
+  - delivery: every due email arrives once and is marked sent
+  - a 550 rejection: that email is retried later, the rest of the batch goes
+  - a refused connection: the batch is retried later, nothing is lost
+  - the last attempt: the email is marked failed, not retried, and purged
+    after the retention period
+  - two workers at once: each email is claimed, and sent, by only one
+
+    python scripts/check_outbox.py
+
+Exits with status 1 and prints the failed checks.
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+
+from aiosmtpd.controller import Controller
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Handler:
+    def __init__(self):
+        self.received = []
+        self.lock = threading.Lock()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("reject"):
+            return "550 5.1.1 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            self.received.extend(envelope.rcpt_tos)
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load_app(port):
+    """Import app.py against a scratch database, with mail going to 127.0.0.1:port"""
+    os.environ.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=str(port), MAIL_USE_TLS="0", MAIL_USERNAME="")
+    workdir = tempfile.mkdtemp(prefix="agro-outbox-")
+    shutil.copy(os.path.join(ROOT, "database.db"), workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app as agro
+    agro.init_db()
+    return agro
+
+
+def queue(agro, *recipients):
+    conn = agro._connect()
+    for recipient in recipients:
+        agro.queue_email(conn, recipient, "Outbox check", f"Hello {recipient}")
+    conn.commit()
+    conn.dispose()
+
+
+def outbox(agro, recipient):
+    conn = agro._connect()
+    row = conn.execute("""
+        SELECT sent_at, failed_at, attempts, last_error, next_attempt_at > CURRENT_TIMESTAMP AS later
+        FROM email_outbox WHERE recipient=?
+    """, (recipient,)).fetchone()
+    conn.dispose()
+    return row
+
+
+def drain(agro):
+    with agro.app.app_context():
+        return agro.drain_outbox()
+
+
+def main():
+    handler = Handler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    agro = load_app(controller.port)
+    failures = []
+
+    def check(label, ok):
+        print(f"{'ok' if ok else 'FAILED':<7} {label}")
+        if not ok:
+            failures.append(label)
+
+    conn = agro._connect()
+    conn.execute("DELETE FROM email_outbox")
+    conn.commit()
+    conn.dispose()
+
+    try:
+        queue(agro, "one@example.com", "two@example.com", "three@example.com")
+        check("delivery: drain reports 3 sent", drain(agro) == 3)
+        check("delivery: each email arrived once",
+              sorted(handler.received) == ["one@example.com", "three@example.com", "two@example.com"])
+        check("delivery: rows marked sent", all(outbox(agro, r)["sent_at"] for r in handler.received))
+        check("delivery: nothing left to send", drain(agro) == 0)
+
+        handler.received.clear()
+        queue(agro, "reject@example.com", "four@example.com")
+        check("550: the rest of the batch is sent", drain(agro) == 1 and handler.received == ["four@example.com"])
+        rejected = outbox(agro, "reject@example.com")
+        check("550: rejected email kept for a later retry",
+              rejected["sent_at"] is None and rejected["attempts"] == 1 and rejected["later"])
+        check("550: the server's reply is recorded", "550" in (rejected["last_error"] or ""))
+
+        # Nothing listens on a fresh free port; Flask-Mail reads its settings when set up
+        handler.received.clear()
+        agro.app.config["MAIL_PORT"] = free_port()
+        agro.app.extensions.pop("mail", None)
+        queue(agro, "five@example.com")
+        check("refused: nothing sent", drain(agro) == 0 and not handler.received)
+        refused = outbox(agro, "five@example.com")
+        check("refused: email kept for a later retry",
+              refused["sent_at"] is None and refused["attempts"] == 1 and refused["later"])
+
+        agro.app.config["MAIL_PORT"] = controller.port
+        agro.app.extensions.pop("mail", None)
+
+        # The rejected email, due again with one attempt left
+        conn = agro._connect()
+        conn.execute("UPDATE email_outbox SET attempts=?, next_attempt_at=CURRENT_TIMESTAMP WHERE recipient=?",
+                     (agro.OUTBOX_MAX_ATTEMPTS - 1, "reject@example.com"))
+        conn.commit()
+        conn.dispose()
+        drain(agro)
+        rejected = outbox(agro, "reject@example.com")
+        check("last attempt: email marked failed",
+              rejected["failed_at"] is not None and rejected["attempts"] == agro.OUTBOX_MAX_ATTEMPTS)
+        conn = agro._connect()
+        conn.execute("UPDATE email_outbox SET next_attempt_at=CURRENT_TIMESTAMP WHERE recipient=?",
+                     ("reject@example.com",))
+        conn.commit()
+        conn.dispose()
+        drain(agro)
+        check("last attempt: not retried", outbox(agro, "reject@example.com")["attempts"] == agro.OUTBOX_MAX_ATTEMPTS)
+        conn = agro._connect()
+        conn.execute("UPDATE email_outbox SET failed_at=datetime('now', ?) WHERE recipient=?",
+                     (f"-{agro.OUTBOX_RETENTION_DAYS + 1} days", "reject@example.com"))
+        conn.commit()
+        conn.dispose()
+        with agro.app.app_context():
+            agro.purge_outbox()
+        check("last attempt: purged after the retention period", outbox(agro, "reject@example.com") is None)
+
+        handler.received.clear()
+        recipients = [f"worker{i}@example.com" for i in range(2 * agro.OUTBOX_BATCH_SIZE)]
+        queue(agro, *recipients)
+        sent = []
+        workers = [threading.Thread(target=lambda: sent.append(drain(agro))) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        check("two workers: every email sent exactly once",
+              sorted(handler.received) == sorted(recipients) and sum(sent) == len(recipients))
+    finally:
+        controller.stop()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
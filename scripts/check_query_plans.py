@@ -0,0 +1,176 @@
+"""Fail if any SQL issued by a route makes SQLite scan a table.
+
+Every route is driven through Flask's test client against a scratch copy of
+database.db; /api/ routes get their data as a JSON body with the session's
+CSRF token. The statements each connection executes are captured with a
+trace callback, then run through EXPLAIN QUERY PLAN. A plan step of the form
+"SCAN <table>" (a full scan that no index narrows or orders) fails the check
+unless the statement is listed in ALLOWED_SCANS with the reason.
+
+    python scripts/check_query_plans.py
+
+Exits with status 1 and prints the offending plans when a scan is found.
+"""
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Statements that read a whole table on purpose, matched by regex
+ALLOWED_SCANS = {
+    r"FROM sales_daily$":
+        "dashboard totals sum the daily rollup, one row per day",
+    r"FROM sales_daily_category GROUP BY category":
+        "dashboard category revenue sums the daily rollup, one row per day and category",
+}
+
+USER = {"name": "Plan Check", "email": "plans@example.com", "password": "secret1"}
+
+USER_ROUTES = [
+    ("GET", "/products", None),
+    ("GET", "/products?search=seed&category=Seeds&min_price=1&max_price=500&sort=price_low", None),
+    ("GET", "/products?category=Seeds&sort=price_high", None),
+    ("GET", "/products?sort=name", None),
+    ("GET", "/products?sort=price_low&per_page=1&cursor=WyJwcmljZV9sb3ciLDEsMV0", None),
+    ("GET", "/products?search=see", None),
+    ("GET", "/product/{pid}", None),
+    ("POST", "/add_review/{pid}", {"rating": "5", "comment": "good"}),
+    ("GET", "/product/{pid}?cursor=WyIyMTAwLTAxLTAxIDAwOjAwOjAwIiwxXQ", None),
+    ("POST", "/add_to_wishlist/{pid}", {}),
+    ("GET", "/wishlist", None),
+    ("POST", "/remove_from_wishlist/1", {}),
+    ("POST", "/add_to_cart/{pid}", {}),
+    ("GET", "/cart", None),
+    ("POST", "/update_cart/1/inc", {}),
+    ("POST", "/update_cart/1/dec", {}),
+    ("POST", "/api/cart/{pid}", '{"quantity": 2}'),
+    ("POST", "/api/cart/{pid}", '{"add": 1}'),
+    ("POST", "/api/cart", '{"items": {"{pid}": 1}}'),
+    ("POST", "/api/wishlist/{pid}", '{"wishlisted": true}'),
+    ("POST", "/api/wishlist/{pid}", '{"wishlisted": false}'),
+    ("POST", "/buy_now/{pid}", {}),
+    ("GET", "/payment", None),
+    ("POST", "/payment", {"payment_method": "cod"}),
+    ("GET", "/orders", None),
+    ("GET", "/download_invoice/1", None),
+    ("GET", "/user/profile", None),
+    ("POST", "/user/profile", {"name": "Plan", "phone": "1", "address": "x"}),
+    ("POST", "/user/change_password", {"old": "wrong", "new": "secret2", "confirm": "secret2"}),
+    ("POST", "/forgot_password", {"email": USER["email"]}),
+    ("GET", "/reset_password/missing-token", None),
+]
+
+ADMIN_ROUTES = [
+    ("GET", "/admin/dashboard", None),
+    ("GET", "/admin/products", None),
+    ("GET", "/admin/products?search=seed&category=Seeds", None),
+    ("POST", "/admin/add_product", {"name": "Plan Seed", "category": "Seeds",
+                                   "price": "10", "stock": "5", "description": "d"}),
+    ("GET", "/admin/edit_product/{pid}", None),
+    ("POST", "/admin/edit_product/{pid}", {"name": "Plan Seed", "category": "Seeds",
+                                          "price": "11", "stock": "50", "description": "d"}),
+    ("GET", "/admin/orders", None),
+    ("GET", "/admin/orders?status=confirmed", None),
+    ("GET", "/admin/orders?email=plans@example.com&date_from=2020-01-01&date_to=2100-01-01", None),
+    ("GET", "/admin/orders?product=seed&status=confirmed", None),
+    ("GET", "/admin/orders?date_from=2020-01-01&cursor=WyIyMTAwLTAxLTAxIDAwOjAwOjAwIiwxXQ", None),
+    ("GET", "/admin/invoices?date_from=2020-01-01&date_to=2100-01-01&email=plans@example.com", None),
+    ("POST", "/admin/update_order_status/1", {"status": "shipped"}),
+    ("GET", "/admin/export_orders", None),
+    ("GET", "/admin/profile", None),
+    ("POST", "/admin/change_password", {"old": "wrong", "new": "secret2", "confirm": "secret2"}),
+    ("GET", "/delete/999999", None),
+]
+
+PLANNED = re.compile(r"^\s*(SELECT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def load_app():
+    workdir = tempfile.mkdtemp(prefix="agro-plans-")
+    shutil.copy(os.path.join(ROOT, "database.db"), workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app as agro
+    agro.init_db()
+    return agro
+
+
+def capture_statements(agro):
+    statements = []
+    connect = agro._connect
+
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    agro._connect = traced_connect
+    return statements
+
+
+def drive(client, routes, pid):
+    for method, path, data in routes:
+        path = path.format(pid=pid)
+        if method == "GET":
+            response = client.get(path)
+        else:
+            with client.session_transaction() as session:
+                token = session.setdefault("csrf_token", "plan-check")
+            if path.startswith("/api/"):
+                response = client.post(path, data=data.replace("{pid}", str(pid)),
+                                       content_type="application/json", headers={"X-CSRF-Token": token})
+            else:
+                response = client.post(path, data={**data, "csrf_token": token})
+        # Streamed responses only run their queries as the body is read
+        response.get_data()
+        if response.status_code >= 500:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}")
+
+
+def main():
+    agro = load_app()
+    statements = capture_statements(agro)
+    client = agro.app.test_client()
+
+    conn = agro._connect()
+    pid = conn.execute(
+        "INSERT INTO products(name, category, price, description, stock) VALUES(?,?,?,?,?)",
+        ("Plan Seed", "Seeds", 10, "seed for plan checks", 100)
+    ).lastrowid
+    conn.execute("UPDATE admin SET password=? WHERE username='admin'",
+                 (agro.generate_password_hash("admin123"),))
+    conn.commit()
+
+    client.post("/register", data={**USER, "confirm_password": USER["password"]})
+    client.post("/login", data={"role": "user", "email": USER["email"], "password": USER["password"]})
+    drive(client, USER_ROUTES, pid)
+    client.get("/logout")
+    client.post("/login", data={"role": "admin", "email": "admin", "password": "admin123"})
+    drive(client, ADMIN_ROUTES, pid)
+
+    failures = []
+    checked = 0
+    for sql in dict.fromkeys(statements):
+        if not PLANNED.match(sql):
+            continue
+        checked += 1
+        flat = " ".join(sql.split())
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        if scans and not any(re.search(p, flat) for p in ALLOWED_SCANS):
+            failures.append((flat, plan))
+
+    print(f"checked {checked} distinct statements")
+    for sql, plan in failures:
+        print(f"\nFULL SCAN: {sql}")
+        for step in plan:
+            print(f"    {step}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Fill a database with synthetic users, products, orders, reviews, wishlist and cart rows.
+
+The app's migrations are applied first, so a new file works as well as an
+existing database. Rows are added to whatever is already there. Generation
+is deterministic for a given --seed. Every seeded user can log in with
+password "password123" (one hash is shared, scrypt is too slow to run per user).
+
+    python scripts/seed_data.py --db /tmp/big.db --orders 1000000
+    python scripts/seed_data.py --help
+
+--db is required so that the checked-in database.db is never seeded by
+accident; name it explicitly if that is what you want.
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ("organic hybrid tomato wheat rice maize cotton seed fertilizer urea "
+         "potash compost neem pesticide sprayer drip pipe tractor harvester "
+         "sickle spade soil tester mulch film greenhouse net bio fungicide "
+         "onion chilli brinjal mustard groundnut soybean sugarcane banana").split()
+CATEGORIES = ["Seeds", "Fertilizer", "Pesticide", "Tools", "Irrigation", "Machinery"]
+STATUSES = ["delivered", "shipped", "confirmed", "pending", "cancelled"]
+STATUS_WEIGHTS = [60, 15, 15, 5, 5]
+PAYMENT_METHODS = ["cod", "upi", "card", "netbanking"]
+PASSWORD = "password123"
+
+
+def load_app():
+    """Import app.py from a scratch directory so its own database.db is not touched."""
+    os.chdir(tempfile.mkdtemp(prefix="agro-seed-"))
+    sys.path.insert(0, ROOT)
+    import app as agro
+    return agro
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def timestamp(rng, now, days):
+    moment = now - timedelta(seconds=rng.randint(0, days * 86400))
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def insert(conn, label, sql, rows, batch_size):
+    start = time.perf_counter()
+    count = 0
+    for batch in chunked(rows, batch_size):
+        conn.executemany(sql, batch)
+        conn.commit()
+        count += len(batch)
+    print(f"{label:<10} {count:>10} rows in {time.perf_counter() - start:6.1f}s")
+
+
+def unique_pairs(rng, count, left, right):
+    """count distinct (left, right) pairs, capped at what the two lists allow"""
+    count = min(count, len(left) * len(right))
+    seen = set()
+    while len(seen) < count:
+        seen.add((rng.choice(left), rng.choice(right)))
+    return seen
+
+
+def seed(conn, agro, args):
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    password = agro.generate_password_hash(PASSWORD)
+
+    first_user = (conn.execute("SELECT MAX(id) FROM users").fetchone()[0] or 0) + 1
+    insert(conn, "users", "INSERT INTO users(id, name, email, password, created_at) VALUES(?,?,?,?,?)",
+           ((first_user + i, f"Seed User {first_user + i}", f"seed{first_user + i}@example.com",
+             password, timestamp(rng, now, 730)) for i in range(args.users)),
+           args.batch_size)
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+
+    first_product = (conn.execute("SELECT MAX(id) FROM products").fetchone()[0] or 0) + 1
+    insert(conn, "products",
+           "INSERT INTO products(id, name, category, price, description, stock, created_at) VALUES(?,?,?,?,?,?,?)",
+           ((first_product + i, " ".join(rng.choices(WORDS, k=3)).title(), rng.choice(CATEGORIES),
+             round(rng.uniform(10, 5000), 2), " ".join(rng.choices(WORDS, k=25)),
+             rng.randint(1000, 100000), timestamp(rng, now, 730)) for i in range(args.products)),
+           args.batch_size)
+    prices, categories = {}, {}
+    for product_id, price, category in conn.execute("SELECT id, price, category FROM products"):
+        prices[product_id], categories[product_id] = price, category
+    product_ids = list(prices)
+
+    # Orders and their lines are generated together so each header gets its total
+    first_order = (conn.execute("SELECT MAX(id) FROM orders").fetchone()[0] or 0) + 1
+    items = []
+
+    def orders():
+        for order_id in range(first_order, first_order + args.orders):
+            lines = rng.sample(product_ids, min(len(product_ids), rng.choices([1, 2, 3, 4], [50, 25, 15, 10])[0]))
+            total = 0
+            for product_id in lines:
+                quantity = rng.randint(1, 5)
+                total += quantity * prices[product_id]
+                items.append((order_id, product_id, quantity, prices[product_id], quantity * prices[product_id],
+                              categories[product_id]))
+            yield (order_id, rng.choice(user_ids), round(total, 2),
+                   rng.choices(STATUSES, STATUS_WEIGHTS)[0], rng.choice(PAYMENT_METHODS),
+                   timestamp(rng, now, 730))
+
+    start = time.perf_counter()
+    for batch in chunked(orders(), args.batch_size):
+        conn.executemany("INSERT INTO orders(id, user_id, total_price, status, payment_method, order_date) "
+                         "VALUES(?,?,?,?,?,?)", batch)
+        conn.executemany("INSERT INTO order_items(order_id, product_id, quantity, unit_price, total_price, category) "
+                         "VALUES(?,?,?,?,?,?)", items)
+        conn.commit()
+        items.clear()
+    print(f"{'orders':<10} {args.orders:>10} rows in {time.perf_counter() - start:6.1f}s")
+
+    insert(conn, "reviews", "INSERT INTO reviews(user_id, product_id, rating, comment, created_at) VALUES(?,?,?,?,?)",
+           ((user_id, product_id, rng.choices([1, 2, 3, 4, 5], [5, 5, 15, 35, 40])[0],
+             " ".join(rng.choices(WORDS, k=12)).capitalize(), timestamp(rng, now, 730))
+            for user_id, product_id in unique_pairs(rng, args.reviews, user_ids, product_ids)),
+           args.batch_size)
+    insert(conn, "wishlist", "INSERT OR IGNORE INTO wishlist(user_id, product_id) VALUES(?,?)",
+           unique_pairs(rng, args.wishlist, user_ids, product_ids), args.batch_size)
+    insert(conn, "cart", "INSERT OR IGNORE INTO cart(user_id, product_id, quantity) VALUES(?,?,?)",
+           ((user_id, product_id, rng.randint(1, 3))
+            for user_id, product_id in unique_pairs(rng, args.cart, user_ids, product_ids)),
+           args.batch_size)
+
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    agro.rebuild_sales_rollups(conn)
+    conn.commit()
+    print(f"{'rollups':<10} {'':>10}      in {time.perf_counter() - start:6.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", required=True, help="database file to fill, created if missing")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--products", type=int, default=5_000)
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--reviews", type=int, default=50_000)
+    parser.add_argument("--wishlist", type=int, default=20_000)
+    parser.add_argument("--cart", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=20_000)
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.db)
+    agro = load_app()
+    conn = sqlite3.connect(path)
+    for pragma in agro.SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    conn.execute("PRAGMA synchronous=OFF")
+    print(f"{path}: schema version {agro.migrate(conn)}")
+
+    start = time.perf_counter()
+    seed(conn, agro, args)
+    conn.close()
+    print(f"done in {time.perf_counter() - start:.1f}s; seeded users log in with {PASSWORD!r}")
+
+
+if __name__ == "__main__":
+    main()
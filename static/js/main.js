@@ -423,4 +423,175 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
+// Cart and wishlist buttons call the JSON API and patch the page in place.
+// Their href is the fallback when the request cannot be made.
+async function postJSON(url, body) {
+    const token = document.querySelector('meta[name="csrf-token"]');
+    const response = await fetch(url, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRF-Token': token ? token.content : ''
+        },
+        body: JSON.stringify(body)
+    });
+    const data = await response.json();
+    return { ok: response.ok, status: response.status, data: data };
+}
+
+function updateBadges(data) {
+    const counts = { cart: data.cart.quantity };
+    if (data.wishlist) {
+        counts.wishlist = data.wishlist.count;
+    }
+    Object.keys(counts).forEach(name => {
+        document.querySelectorAll(`[data-badge="${name}"]`).forEach(badge => {
+            badge.textContent = counts[name];
+            badge.hidden = !counts[name];
+        });
+    });
+}
+
+// On the cart page quantity edits are batched: the whole basket goes to
+// /api/cart in one request once the customer stops clicking or typing
+let cartSyncTimer;
+
+function cartBasket() {
+    const items = {};
+    document.querySelectorAll('[data-cart-line]').forEach(row => {
+        items[row.dataset.cartLine] = Math.max(0, parseInt(row.querySelector('.quantity').value) || 0);
+    });
+    return items;
+}
+
+function scheduleCartSync(delay) {
+    clearTimeout(cartSyncTimer);
+    cartSyncTimer = setTimeout(syncCart, delay);
+}
+
+async function syncCart() {
+    try {
+        const result = await postJSON('/api/cart', { items: cartBasket() });
+        if (result.status === 401 || result.status === 403) {
+            window.location.reload();
+            return;
+        }
+        if (!result.ok) {
+            (result.data.problems || []).forEach(problem => {
+                const row = document.querySelector(`[data-cart-line="${problem.product_id}"]`);
+                if (row) row.querySelector('[data-stock-limit]').hidden = false;
+            });
+            showToast(result.data.error, result.status === 409 ? 'warning' : 'danger');
+            return;
+        }
+        renderCart(result.data);
+    } catch (err) {
+        showToast('Could not update the cart, please try again', 'danger');
+    }
+}
+
+function renderCart(data) {
+    if (data.cart.lines === 0) {
+        window.location.reload();
+        return;
+    }
+    const lines = {};
+    data.lines.forEach(line => lines[line.product_id] = line);
+    
+    document.querySelectorAll('[data-cart-line]').forEach(row => {
+        const line = lines[row.dataset.cartLine];
+        if (!line) {
+            row.remove();
+            return;
+        }
+        row.querySelector('[data-line-subtotal]').textContent = formatCurrency(line.subtotal);
+        row.querySelector('[data-stock-limit]').hidden = line.quantity < line.stock;
+    });
+    document.querySelectorAll('[data-cart-lines]').forEach(el => el.textContent = data.cart.lines);
+    document.querySelectorAll('[data-cart-total]').forEach(el => el.textContent = formatCurrency(data.cart.total));
+    updateBadges(data);
+}
+
+document.addEventListener('click', function(e) {
+    const button = e.target.closest('[data-cart-step]');
+    if (!button || e.defaultPrevented || !document.querySelector('meta[name="csrf-token"]')) return;
+    e.preventDefault();
+    
+    const input = button.closest('[data-cart-line]').querySelector('.quantity');
+    const step = button.dataset.cartStep;
+    const quantity = parseInt(input.value) || 0;
+    if (step === 'remove') {
+        input.value = 0;
+        scheduleCartSync(0);
+        return;
+    }
+    input.value = Math.min(parseInt(input.max) || Infinity, Math.max(0, quantity + parseInt(step)));
+    scheduleCartSync(400);
+});
+
+document.addEventListener('change', function(e) {
+    if (e.target.matches('[data-cart-line] .quantity')) {
+        scheduleCartSync(400);
+    }
+});
+
+function updateWishlistButton(button, inWishlist) {
+    button.dataset.wishlisted = inWishlist ? 'true' : 'false';
+    if (button.classList.contains('wishlist-btn')) {
+        button.classList.toggle('active', inWishlist);
+        button.textContent = inWishlist ? '❤' : '🤍';
+    } else if (!button.closest('[data-wishlist-item]')) {
+        button.textContent = (inWishlist ? 'Remove from' : 'Add to') + ' Wishlist';
+    }
+}
+
+document.addEventListener('click', async function(e) {
+    const button = e.target.closest('[data-cart-add], [data-wishlist]');
+    if (!button || e.defaultPrevented || !document.querySelector('meta[name="csrf-token"]')) return;
+    e.preventDefault();
+    if (button.dataset.busy) return;
+    button.dataset.busy = '1';
+    
+    let url, body;
+    if (button.dataset.cartAdd) {
+        url = `/api/cart/${button.dataset.cartAdd}`;
+        body = { add: 1 };
+    } else {
+        url = `/api/wishlist/${button.dataset.wishlist}`;
+        body = { wishlisted: button.dataset.wishlisted !== 'true' };
+    }
+    
+    try {
+        const result = await postJSON(url, body);
+        if (result.status === 401 || result.status === 403) {
+            button.form.requestSubmit(button);
+            return;
+        }
+        if (result.data.cart) {
+            updateBadges(result.data);
+        }
+        if (!result.ok) {
+            showToast(result.data.error, result.status === 409 ? 'warning' : 'danger');
+            return;
+        }
+        
+        if (button.dataset.cartAdd) {
+            addToCartAnimation(button);
+        } else {
+            const card = button.closest('[data-wishlist-item]');
+            if (card && !result.data.wishlist.in_wishlist) {
+                card.remove();
+                if (result.data.wishlist.count === 0) window.location.reload();
+            }
+            updateWishlistButton(button, result.data.wishlist.in_wishlist);
+        }
+        showToast(result.data.message, 'success');
+    } catch (err) {
+        button.form.requestSubmit(button);
+    } finally {
+        delete button.dataset.busy;
+    }
+});
+
 console.log('Agro Store JavaScript loaded successfully!');
\ No newline at end of file
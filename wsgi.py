@@ -0,0 +1,11 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Run it from the directory holding database.db, static/uploads and
+invoice_cache. Set SECRET_KEY (or give every host the same secret_key file)
+so sessions survive restarts and work across workers.
+"""
+from app import create_app
+
+app = create_app()